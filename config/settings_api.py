@@ -0,0 +1,41 @@
+"""
+Django settings for the API-only deployment (payments/ endpoints).
+
+Run the callback/checkout worker pool with
+DJANGO_SETTINGS_MODULE=config.settings_api and keep config.settings for the
+admin site. The API serves no sessions, logins or flash messages, so those
+apps and middleware are dropped to keep each request short.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# Apps only needed by the admin site
+API_EXCLUDED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+)
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in API_EXCLUDED_APPS]
+
+# Session/auth/messages middleware, plus CSRF which is only kept for the admin site
+API_EXCLUDED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)
+
+MIDDLEWARE = [mw for mw in MIDDLEWARE if mw not in API_EXCLUDED_MIDDLEWARE]
+
+# Templates only need the request context processor without auth/messages
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'OPTIONS': {
+        **TEMPLATES[0]['OPTIONS'],
+        'context_processors': ['django.template.context_processors.request'],
+    },
+}]
+
+# URLs without the admin site
+ROOT_URLCONF = 'config.urls_api'
@@ -3,15 +3,12 @@ URL configuration for config project.
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.shortcuts import redirect
+from django.views.generic import RedirectView
 from django.conf import settings
 from django.conf.urls.static import static
 
-def home_redirect(request):
-    return redirect('/payments/')
-
 urlpatterns = [
-    path('', home_redirect, name='home'),
+    path('', RedirectView.as_view(pattern_name='payment_form', permanent=True), name='home'),
     path('admin/', admin.site.urls),
     path('payments/', include('mpesa.urls'))
 ]
@@ -0,0 +1,10 @@
+"""
+URL configuration for the API-only deployment (see config.settings_api).
+"""
+from django.urls import path, include
+from django.views.generic import RedirectView
+
+urlpatterns = [
+    path('', RedirectView.as_view(pattern_name='payment_form', permanent=True), name='home'),
+    path('payments/', include('mpesa.urls'))
+]
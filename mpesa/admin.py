@@ -27,7 +27,10 @@ Date: 2024
 """
 
 from django.contrib import admin
+from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_cookie
 from .models import Transaction
+from .signals import transaction_list_version
 
 
 @admin.register(Transaction)
@@ -59,7 +62,13 @@ class TransactionAdmin(admin.ModelAdmin):
     ]
     
     # Filter options for transaction listing
-    list_filter = ['status', 'created']  # Filter by status and creation date
+    list_filter = [('created', admin.DateFieldListFilter), 'status']  # Filter by creation date and status
+
+    # Skip the per-option COUNT(*) queries for filter facets
+    show_facets = admin.ShowFacets.NEVER
+    
+    # Skip the unfiltered COUNT(*) behind "N results (M total)" when searching/filtering
+    show_full_result_count = False
     
     # Search functionality across key fields
     search_fields = ['transaction_no', 'phone_number', 'reference', 'receipt_no']
@@ -89,3 +98,38 @@ class TransactionAdmin(admin.ModelAdmin):
             'description': 'System-generated metadata and tracking information'
         }),
     )
+
+    def get_queryset(self, request):
+        """
+        Limit the changelist query to the columns shown in list_display.
+
+        The detail view still loads the full row, since it needs every field.
+        """
+        queryset = super().get_queryset(request)
+        match = getattr(request, 'resolver_match', None)
+        if match and match.url_name == 'mpesa_transaction_changelist':
+            queryset = queryset.only(*self._list_display_fields())
+        return queryset
+
+    def _list_display_fields(self):
+        """Return the concrete model fields in list_display (callables can't be deferred)."""
+        field_names = {field.name for field in self.model._meta.concrete_fields}
+        return ['pk'] + [name for name in self.list_display if name in field_names]
+
+    def changelist_view(self, request, extra_context=None):
+        """
+        Cache the rendered list per user (cookie) and query string for a short window.
+
+        The cache key carries the transaction list version (see signals.py),
+        so any transaction write makes the cached pages stale immediately.
+        """
+        key_prefix = 'txn-changelist-v%s' % transaction_list_version()
+        view = cache_page(30, key_prefix=key_prefix)(vary_on_cookie(self._render_changelist))
+        return view(request, extra_context)
+
+    def _render_changelist(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        # Render here so cache_page stores the page before admin_view adds never_cache headers
+        if hasattr(response, 'render'):
+            response.render()
+        return response
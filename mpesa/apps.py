@@ -9,6 +9,9 @@ Components:
     - MpesaConfig: Main app configuration class
     - Auto field configuration for model primary keys
     - App name and metadata settings
+    - Background log listeners for the queued file handlers
+    - Startup warm-up of URL resolver and phone number metadata
+    - Signal receivers that invalidate cached transaction lists
 
 App Features:
     - M-Pesa STK Push payment processing
@@ -27,7 +30,143 @@ Author: M-Pesa Integration Team
 Date: 2024
 """
 
+import atexit
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
 from django.apps import AppConfig
+from django.conf import settings
+
+# Listeners running in this process, and the pid they were started in.
+# Threads don't survive fork(): under gunicorn's preload_app the master runs
+# ready(), so each worker must start its own listeners
+_log_listeners = []
+_log_listeners_pid = None
+_log_listeners_lock = threading.Lock()
+
+
+def gzip_namer(name):
+    """Name rotated log files with a .gz suffix (django.log.1.gz, ...)."""
+    return name + '.gz'
+
+
+def gzip_rotator(source, dest):
+    """Compress the log file being rotated out into dest and remove it."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def start_log_listeners():
+    """
+    Start a QueueListener for each entry in settings.LOG_QUEUE_LISTENERS.
+    
+    The LOGGING file handlers are QueueHandlers, so request threads only
+    enqueue records; the listener thread does the rotating file writes and
+    gzips each rotated backup.
+    
+    Listeners are started once per process. In a forked child (a gunicorn
+    worker of a preloaded app) the inherited listener threads are gone, so
+    a new set is started there.
+    
+    Returns:
+        list: The running QueueListener instances
+    """
+    global _log_listeners, _log_listeners_pid
+    pid = os.getpid()
+    if _log_listeners_pid == pid:
+        return _log_listeners
+    
+    with _log_listeners_lock:
+        # Re-check: another thread may have started them while we waited
+        if _log_listeners_pid == pid:
+            return _log_listeners
+        _log_listeners = _start_listeners()
+        _log_listeners_pid = pid
+    return _log_listeners
+
+
+def _start_listeners():
+    """Create and start the listeners for this process."""
+    listeners = []
+    formatters = settings.LOGGING.get('formatters', {})
+    for entry in getattr(settings, 'LOG_QUEUE_LISTENERS', ()):
+        handler = RotatingFileHandler(
+            entry['filename'],
+            maxBytes=entry['maxBytes'],
+            backupCount=entry['backupCount'],
+            encoding='utf-8',
+            delay=True,  # Don't open the file until the first record arrives
+        )
+        # Rotated backups are gzipped (in the listener thread, not the request thread)
+        handler.namer = gzip_namer
+        handler.rotator = gzip_rotator
+        formatter = formatters.get(entry.get('formatter'), {})
+        handler.setFormatter(logging.Formatter(
+            formatter.get('format'), style=formatter.get('style', '%'),
+        ))
+        
+        listener = QueueListener(entry['queue'], handler)
+        listener.start()
+        listeners.append(listener)
+    
+    return listeners
+
+
+def _stop_log_listeners():
+    """Flush queued records on shutdown, if this process owns the listeners."""
+    if _log_listeners_pid == os.getpid():
+        for listener in _log_listeners:
+            listener.stop()
+
+
+atexit.register(_stop_log_listeners)
+
+
+def _reset_after_fork():
+    """
+    Give a forked child clean queues and a clean lock.
+    
+    The parent's listener threads aren't copied, but the queues still list
+    them as waiters (so put() would wake a thread that doesn't exist) and
+    may hold records the parent is still writing. Re-initialising each
+    queue in place keeps the handlers' and listeners' references valid.
+    """
+    global _log_listeners_lock
+    _log_listeners_lock = threading.Lock()
+    if not settings.configured:
+        return
+    for entry in getattr(settings, 'LOG_QUEUE_LISTENERS', ()):
+        log_queue = entry['queue']
+        log_queue.__init__(log_queue.maxsize)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class ProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler that makes sure this process has a listener draining its queue.
+    
+    The first record logged in a process (e.g. a freshly forked gunicorn
+    worker) starts the listeners there. Queues are bounded; if a listener
+    falls behind, new records are dropped instead of blocking the request
+    thread or growing memory.
+    """
+    
+    def enqueue(self, record):
+        """Put the record on the queue, starting this process's listeners first."""
+        if _log_listeners_pid != os.getpid():
+            start_log_listeners()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
 
 
 class MpesaConfig(AppConfig):
@@ -51,3 +190,20 @@ class MpesaConfig(AppConfig):
     
     # App name for Django registration and routing
     name = 'mpesa'
+    
+    def ready(self):
+        """
+        Start the background log listeners and warm up per-process caches.
+        
+        Runs once per process at startup (in the master when gunicorn
+        preloads the app), so the first callback doesn't pay for URL
+        resolver and phone number metadata initialisation. Forked workers
+        start their own log listeners on their first record.
+        """
+        start_log_listeners()
+        
+        # Connect the cache invalidation receivers
+        from . import signals
+        
+        from . import views
+        views.warm_up()
@@ -34,21 +34,158 @@ Updated: 2025
 import logging
 import hashlib
 import hmac
+import ipaddress
 import json
+import socket
+import struct
 import time
 import base64
+import binascii
 from datetime import datetime, timedelta
+from collections import namedtuple
+from functools import lru_cache
 from django.core.cache import cache
 from django.conf import settings
 from rest_framework.permissions import BasePermission
 from rest_framework.response import Response
 from rest_framework import status
 
+from .utils import TokenBucket, is_trusted_proxy, json_loads
+
 # Initialize secure logger
 security_logger = logging.getLogger('mpesa.security')
 logger = logging.getLogger('mpesa')
 
 
+def _ipv4_to_int(ip):
+    """
+    Convert a dotted-quad IPv4 address to a 32-bit integer.
+    
+    Raises:
+        OSError: If ip is not a valid IPv4 address
+    """
+    return struct.unpack('!I', socket.inet_pton(socket.AF_INET, ip))[0]
+
+
+@lru_cache(maxsize=1024)
+def _parse_ipv4(ip):
+    """
+    Parse an IPv4 address string to an integer, cached since callback IPs repeat.
+    
+    Returns:
+        int: The address as an integer, or None if ip is not valid IPv4
+    """
+    try:
+        return _ipv4_to_int(ip)
+    except (OSError, TypeError):
+        return None
+
+
+def _cidr_to_base_mask(cidr):
+    """Convert an IPv4 CIDR range to an integer (network base, netmask) pair."""
+    address, bits = cidr.split('/')
+    mask = (0xFFFFFFFF << (32 - int(bits))) & 0xFFFFFFFF
+    return _ipv4_to_int(address) & mask, mask
+
+
+def _group_ranges_by_mask(cidrs):
+    """
+    Group IPv4 CIDR ranges by prefix length.
+    
+    Args:
+        cidrs (iterable): CIDR strings, e.g. '196.201.214.0/24'
+        
+    Returns:
+        tuple: (netmask, frozenset of network bases) pairs, one per prefix
+               length, so an address needs one masked set lookup per length
+    """
+    by_mask = {}
+    for cidr in cidrs:
+        base, mask = _cidr_to_base_mask(cidr)
+        by_mask.setdefault(mask, set()).add(base)
+    return tuple((mask, frozenset(bases)) for mask, bases in by_mask.items())
+
+
+# Non-public IPv4 ranges (private, link-local, documentation, multicast, reserved).
+# Loopback is kept separate because it is allowed in DEBUG.
+_IPV4_LOOPBACK = _cidr_to_base_mask('127.0.0.0/8')
+_IPV4_NON_PUBLIC_RANGES = tuple(_cidr_to_base_mask(cidr) for cidr in (
+    '0.0.0.0/8',
+    '10.0.0.0/8',
+    '169.254.0.0/16',
+    '172.16.0.0/12',
+    '192.0.0.0/24',
+    '192.0.2.0/24',
+    '192.168.0.0/16',
+    '198.18.0.0/15',
+    '198.51.100.0/24',
+    '203.0.113.0/24',
+    '224.0.0.0/4',   # Multicast
+    '240.0.0.0/4',   # Reserved and broadcast
+))
+
+
+@lru_cache(maxsize=1024)
+def _ip_scope(ip):
+    """
+    Classify an IP address string, cached since callback IPs repeat.
+    
+    Args:
+        ip (str): IP address to classify
+        
+    Returns:
+        str: 'public', 'private', 'loopback' or 'invalid'
+    """
+    ip_int = _parse_ipv4(ip)
+    if ip_int is None:
+        # Not IPv4: IPv6 has a long list of special ranges, so defer to ipaddress
+        try:
+            ip_obj = ipaddress.ip_address(ip)
+        except ValueError:
+            return 'invalid'
+        if ip_obj.is_loopback:
+            return 'loopback'
+        return 'private' if (ip_obj.is_private or ip_obj.is_multicast) else 'public'
+    
+    base, mask = _IPV4_LOOPBACK
+    if ip_int & mask == base:
+        return 'loopback'
+    if any(ip_int & mask == base for base, mask in _IPV4_NON_PUBLIC_RANGES):
+        return 'private'
+    return 'public'
+
+
+@lru_cache(maxsize=1024)
+def _unauthorized_warning_bucket(ip):
+    """
+    Per-IP token bucket bounding "Unauthorized callback" warnings.
+    
+    A burst of 20 warnings is logged, then one a second, so a flood of
+    rejected requests can't turn into a flood of log writes. The lru_cache
+    keeps one bucket for each of the 1024 most recent addresses.
+    """
+    return TokenBucket(capacity=20, refill_per_sec=1.0)
+
+
+# Official Safaricom IP addresses for M-Pesa callbacks
+# These IPs are provided by Safaricom and should be kept updated
+# (a set, so the membership check is a single hash lookup)
+_SAFARICOM_IPS = frozenset((
+    '196.201.214.200',  # Primary callback server
+    '196.201.214.206',  # Secondary callback server 
+    '196.201.213.114',  # Backup server 1
+    '196.201.214.207',  # Backup server 2
+    '196.201.214.208',  # Backup server 3
+    '196.201.213.44',   # Regional server 1
+    '196.201.212.127',  # Regional server 2
+    '196.201.212.138',  # Regional server 3
+    '196.201.212.129',  # Regional server 4
+    '196.201.212.136',  # Regional server 5
+    '196.201.212.74',   # Load balancer 1
+    '196.201.212.69'    # Load balancer 2
+))
+
+
 class SafaricomIPWhitelist(BasePermission):
     """
     Enhanced permission class to validate M-Pesa callback requests from Safaricom.
@@ -58,32 +195,17 @@ class SafaricomIPWhitelist(BasePermission):
     enhanced logging, monitoring, and security features.
     
     Attributes:
-        SAFARICOM_IPS (list): Official IP addresses used by Safaricom for callbacks
+        SAFARICOM_IPS (frozenset): Official IP addresses used by Safaricom for callbacks
         SAFARICOM_IP_RANGES (list): IP ranges for additional validation
     
     Methods:
         has_permission: Validates if request IP is from Safaricom
         get_client_ip: Enhanced client IP extraction with proxy support
-        is_ip_in_range: Check if IP is within allowed ranges
         log_security_event: Enhanced security logging
     """
     
-    # Official Safaricom IP addresses for M-Pesa callbacks
-    # These IPs are provided by Safaricom and should be kept updated
-    SAFARICOM_IPS = [
-        '196.201.214.200',  # Primary callback server
-        '196.201.214.206',  # Secondary callback server 
-        '196.201.213.114',  # Backup server 1
-        '196.201.214.207',  # Backup server 2
-        '196.201.214.208',  # Backup server 3
-        '196.201.213.44',   # Regional server 1
-        '196.201.212.127',  # Regional server 2
-        '196.201.212.138',  # Regional server 3
-        '196.201.212.129',  # Regional server 4
-        '196.201.212.136',  # Regional server 5
-        '196.201.212.74',   # Load balancer 1
-        '196.201.212.69'    # Load balancer 2
-    ]
+    # Official Safaricom IP addresses for M-Pesa callbacks (see _SAFARICOM_IPS)
+    SAFARICOM_IPS = _SAFARICOM_IPS
 
     # Additional IP ranges for Safaricom (CIDR notation)
     SAFARICOM_IP_RANGES = [
@@ -93,11 +215,33 @@ class SafaricomIPWhitelist(BasePermission):
     ]
 
     # Development/testing IPs (only when DEBUG=True)
-    DEVELOPMENT_IPS = [
+    DEVELOPMENT_IPS = frozenset((
         '127.0.0.1',      # Localhost
         '::1',            # IPv6 localhost
         '0.0.0.0'         # Any interface
-    ]
+    ))
+
+    # Ranges precomputed at import as integer network bases grouped by netmask;
+    # a range check is then one (ip & mask) set lookup per prefix length
+    _IP_RANGES_BY_MASK = _group_ranges_by_mask(SAFARICOM_IP_RANGES)
+
+    # Sliding-window rate limit: 100 callbacks per IP over the last 60s,
+    # counted in 10s buckets
+    RATE_LIMIT_MAX_REQUESTS = 100
+    RATE_LIMIT_WINDOW_SECONDS = 60
+    RATE_LIMIT_BUCKET_SECONDS = 10
+
+    # Priority order for client IP extraction
+    IP_HEADERS = (
+        'HTTP_X_FORWARDED_FOR',      # Standard proxy header
+        'HTTP_X_REAL_IP',            # Nginx proxy header
+        'HTTP_CF_CONNECTING_IP',     # Cloudflare header
+        'HTTP_X_FORWARDED',          # Alternative forwarded header
+        'HTTP_X_CLUSTER_CLIENT_IP',  # Cluster environments
+        'HTTP_FORWARDED_FOR',        # RFC 7239
+        'HTTP_FORWARDED',            # RFC 7239 standard
+        'REMOTE_ADDR',               # Direct connection
+    )
 
     def has_permission(self, request, view):
         """
@@ -113,6 +257,18 @@ class SafaricomIPWhitelist(BasePermission):
         Returns:
             bool: True if request is authorized, False otherwise
         """
+        # DRF's permission check and validate_callback both ask; decide (and
+        # count towards the rate limit) once per request
+        decision = vars(request).get('_mpesa_ip_authorized')
+        if decision is not None:
+            return decision
+        
+        decision = self._check_permission(request)
+        request._mpesa_ip_authorized = decision
+        return decision
+    
+    def _check_permission(self, request):
+        """Run the rate limit and IP whitelist checks for has_permission."""
         # Extract client IP and request metadata
         client_ip = self.get_client_ip(request)
         user_agent = request.META.get('HTTP_USER_AGENT', 'Unknown')
@@ -125,25 +281,22 @@ class SafaricomIPWhitelist(BasePermission):
             'user_agent': user_agent,
             'method': request_method,
             'path': request_path,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': time.time(),  # Formatted only if an event is logged
             'content_type': request.META.get('CONTENT_TYPE', ''),
             'content_length': request.META.get('CONTENT_LENGTH', '0'),
             'remote_addr': request.META.get('REMOTE_ADDR', ''),
-            # Only include safe headers (avoid complex objects)
-            'headers': {
-                k: str(v) for k, v in request.META.items() 
-                if k.startswith('HTTP_') and isinstance(v, (str, int, float))
-                and 'AUTHORIZATION' not in k and 'COOKIE' not in k
-            }
+            # Headers are only collected if an event is logged at DEBUG
+            'get_headers': lambda: self._safe_headers(request),
         }
         
-        # Log callback attempt
-        security_logger.info("M-Pesa callback security validation initiated", extra={
-            'client_ip': client_ip,
-            'path': request_path,
-            'method': request_method,
-            'user_agent_hash': hashlib.sha256(user_agent.encode()).hexdigest()[:16]
-        })
+        # Log callback attempt (debug only: the outcome is logged below either way)
+        if security_logger.isEnabledFor(logging.DEBUG):
+            security_logger.debug("M-Pesa callback security validation initiated", extra={
+                'client_ip': client_ip,
+                'path': request_path,
+                'method': request_method,
+                'user_agent_hash': hashlib.sha256(user_agent.encode()).hexdigest()[:16]
+            })
         
         # Check rate limiting first
         if not self._check_rate_limit(client_ip):
@@ -159,7 +312,8 @@ class SafaricomIPWhitelist(BasePermission):
             self._track_successful_callback(client_ip)
             return True
         else:
-            security_logger.warning("Unauthorized M-Pesa callback attempt", extra={'client_ip_hash': hashlib.sha256(client_ip.encode()).hexdigest()[:16]})
+            if _unauthorized_warning_bucket(client_ip).try_acquire():
+                security_logger.warning("Unauthorized M-Pesa callback attempt", extra={'client_ip_hash': hashlib.sha256(client_ip.encode()).hexdigest()[:16]})
             # Track failed attempts for security monitoring
             self._track_failed_attempt(client_ip)
             return False
@@ -174,101 +328,125 @@ class SafaricomIPWhitelist(BasePermission):
         Returns:
             bool: True if IP is authorized
         """
-        # Check exact IP matches
-        if client_ip in self.SAFARICOM_IPS:
-            return True
-        
         # In development mode, allow local IPs
         if getattr(settings, 'DEBUG', False) and client_ip in self.DEVELOPMENT_IPS:
             security_logger.info("Development mode: Local IP authorized", extra={'mode': 'development'})
             return True
         
-        # Check IP ranges (basic implementation)
-        for ip_range in self.SAFARICOM_IP_RANGES:
-            if self._ip_in_range(client_ip, ip_range):
-                return True
+        # Exact matches (the usual case) need no parsing
+        if client_ip in self.SAFARICOM_IPS:
+            return True
         
-        return False
-    
-    def _ip_in_range(self, ip, cidr_range):
-        """
-        Check if IP is within CIDR range (basic implementation).
+        # Safaricom only calls back over IPv4; anything else is rejected.
+        # Parsed once per distinct address (get_client_ip already did it).
+        ip_int = _parse_ipv4(client_ip)
+        if ip_int is None:
+            return False
         
-        Args:
-            ip (str): IP address to check
-            cidr_range (str): CIDR notation range
-            
-        Returns:
-            bool: True if IP is in range
-        """
-        try:
-            import ipaddress
-            return ipaddress.ip_address(ip) in ipaddress.ip_network(cidr_range, strict=False)
-        except (ValueError, ImportError):
-            # Fallback to basic prefix matching
-            network_prefix = cidr_range.split('/')[0].rsplit('.', 1)[0]
-            return ip.startswith(network_prefix)
+        return any(ip_int & mask in bases for mask, bases in self._IP_RANGES_BY_MASK)
     
     def _check_rate_limit(self, client_ip):
         """
         Implement rate limiting for callback requests.
         
+        Uses a sliding window of short buckets rather than one fixed-minute
+        counter, so a burst straddling a minute boundary can't get through
+        twice the limit.
+        
         Args:
             client_ip (str): Client IP address
             
         Returns:
             bool: True if within rate limits
         """
-        cache_key = f"mpesa_callback_rate_limit:{client_ip}"
-        current_requests = cache.get(cache_key, 0)
+        max_requests = self.RATE_LIMIT_MAX_REQUESTS
+        bucket_seconds = self.RATE_LIMIT_BUCKET_SECONDS
+        bucket_count = self.RATE_LIMIT_WINDOW_SECONDS // bucket_seconds
+        
+        # Count this request in the current bucket
+        key_prefix = f"mpesa_callback_rate_limit:{client_ip}"
+        current_bucket = int(time.time()) // bucket_seconds
+        current_requests = self._increment_counter(
+            f"{key_prefix}:{current_bucket}",
+            self.RATE_LIMIT_WINDOW_SECONDS + bucket_seconds,
+        )
         
-        # Allow max 100 requests per minute per IP
-        max_requests = 100
-        window_minutes = 1
+        # Add the rest of the window's buckets, fetched in one cache round trip
+        previous_keys = [f"{key_prefix}:{current_bucket - i}" for i in range(1, bucket_count)]
+        current_requests += sum(cache.get_many(previous_keys).values())
         
-        if current_requests >= max_requests:
+        if current_requests > max_requests:
             security_logger.warning("Rate limit exceeded for callback requests", extra={
                 'requests_count': current_requests,
                 'max_allowed': max_requests
             })
             return False
         
-        # Increment counter with expiration
-        cache.set(cache_key, current_requests + 1, 60 * window_minutes)
         return True
     
+    def _increment_counter(self, cache_key, timeout):
+        """
+        Atomically increment a cache counter, creating it with the given timeout.
+        
+        add() only succeeds for the first request in a window, so concurrent
+        workers can't overwrite each other's counts as they could with get/set.
+        
+        Args:
+            cache_key (str): Counter cache key
+            timeout (int): Counter lifetime in seconds, set when it is created
+            
+        Returns:
+            int: Counter value after the increment
+        """
+        if cache.add(cache_key, 1, timeout):
+            return 1
+        try:
+            return cache.incr(cache_key)
+        except ValueError:
+            # Expired between add() and incr(); start a new window
+            cache.set(cache_key, 1, timeout)
+            return 1
+    
     def _track_successful_callback(self, client_ip):
         """Track successful callbacks for monitoring."""
         cache_key = f"mpesa_callback_success:{client_ip}:daily"
-        current_count = cache.get(cache_key, 0)
-        cache.set(cache_key, current_count + 1, 86400)  # 24 hours
+        self._increment_counter(cache_key, 86400)  # 24 hours
     
     def _track_failed_attempt(self, client_ip):
         """Track failed attempts for security monitoring."""
         cache_key = f"mpesa_callback_failed:{client_ip}:hourly"
-        current_count = cache.get(cache_key, 0)
-        cache.set(cache_key, current_count + 1, 3600)  # 1 hour
+        attempt_count = self._increment_counter(cache_key, 3600)  # 1 hour
         
         # Alert if too many failed attempts
-        if current_count + 1 >= 10:
+        if attempt_count >= 10:
             security_logger.critical("Multiple failed callback attempts detected", extra={
-                'attempt_count': current_count + 1,
+                'attempt_count': attempt_count,
                 'time_window': '1_hour'
             })
     
+    def _safe_headers(self, request):
+        """Return the request's HTTP headers without credentials or complex objects."""
+        return {
+            k: str(v) for k, v in request.META.items() 
+            if k.startswith('HTTP_') and isinstance(v, (str, int, float))
+            and 'AUTHORIZATION' not in k and 'COOKIE' not in k
+        }
+    
     def log_security_event(self, event_type, context):
         """
         Secure logging that doesn't expose sensitive information.
         
         Args:
             event_type (str): Type of security event
-            context (dict): Security context information (will be sanitized)
+            context (dict): Security context information (will be sanitized);
+                            'get_headers' is an optional callable returning the headers
         """
         try:
             # Create sanitized log entry
+            event_time = context.get('timestamp')
             sanitized_context = {
                 'event_type': event_type,
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': datetime.fromtimestamp(event_time or time.time()).isoformat(),
                 'method': context.get('method', 'Unknown'),
                 'path': context.get('path', 'Unknown'),
                 'content_type': context.get('content_type', ''),
@@ -285,6 +463,14 @@ class SafaricomIPWhitelist(BasePermission):
                 security_logger.info(f"Security event: {event_type}", extra={'event_type': event_type})
             else:
                 security_logger.info(f"Security event: {event_type}", extra={'event_type': event_type})
+            
+            # Request headers are only walked when DEBUG logging is on
+            get_headers = context.get('get_headers')
+            if get_headers and security_logger.isEnabledFor(logging.DEBUG):
+                security_logger.debug(f"Security event headers: {event_type}", extra={
+                    'event_type': event_type,
+                    'headers': get_headers(),
+                })
                 
         except Exception as e:
             # Fallback logging without exposing error details
@@ -295,7 +481,9 @@ class SafaricomIPWhitelist(BasePermission):
         Enhanced client IP extraction with comprehensive proxy support.
         
         This method handles various proxy scenarios including multiple
-        forwarding headers, CDNs, and load balancers.
+        forwarding headers, CDNs, and load balancers. The result is stored
+        on the request, so the permission check, the security context and
+        the view share a single header scan.
         
         Args:
             request (Request): DRF request object
@@ -303,20 +491,43 @@ class SafaricomIPWhitelist(BasePermission):
         Returns:
             str: Client IP address as a string
         """
-        # Priority order for IP extraction
-        ip_headers = [
-            'HTTP_X_FORWARDED_FOR',      # Standard proxy header
-            'HTTP_X_REAL_IP',            # Nginx proxy header
-            'HTTP_CF_CONNECTING_IP',     # Cloudflare header
-            'HTTP_X_FORWARDED',          # Alternative forwarded header
-            'HTTP_X_CLUSTER_CLIENT_IP',  # Cluster environments
-            'HTTP_FORWARDED_FOR',        # RFC 7239
-            'HTTP_FORWARDED',            # RFC 7239 standard
-            'REMOTE_ADDR'                # Direct connection
-        ]
-        
-        for header in ip_headers:
-            ip_value = request.META.get(header)
+        # Already resolved for this request
+        client_ip = vars(request).get('_mpesa_client_ip')
+        if client_ip is not None:
+            return client_ip
+        
+        client_ip = self._extract_client_ip(request)
+        request._mpesa_client_ip = client_ip
+        return client_ip
+    
+    def _extract_client_ip(self, request):
+        """
+        Resolve the client IP: REMOTE_ADDR unless a trusted proxy connected,
+        then the trusted proxy header, else the first public IP in IP_HEADERS.
+        """
+        meta = request.META
+        remote_addr = meta.get('REMOTE_ADDR', 'Unknown')
+        
+        # Forwarding headers only mean something when a trusted proxy set them
+        # (settings.ALLOWED_PROXY_IPS); anyone connecting directly could send
+        # X-Forwarded-For with a Safaricom address
+        if not is_trusted_proxy(remote_addr):
+            return remote_addr
+        
+        # A single header set by the proxy (settings.MPESA_TRUSTED_IP_HEADER)
+        trusted_header = getattr(settings, 'MPESA_TRUSTED_IP_HEADER', None)
+        if trusted_header:
+            ip_value = meta.get(trusted_header)
+            if ip_value:
+                try:
+                    ip = str(ipaddress.ip_address(ip_value.split(',', 1)[0].strip()))
+                except ValueError:
+                    ip = None
+                if ip and self._is_valid_public_ip(ip):
+                    return ip
+        
+        for header in self.IP_HEADERS:
+            ip_value = meta.get(header)
             if ip_value:
                 # Handle comma-separated IPs (proxy chain)
                 if ',' in ip_value:
@@ -329,7 +540,7 @@ class SafaricomIPWhitelist(BasePermission):
                     return ip
         
         # Fallback to REMOTE_ADDR
-        return request.META.get('REMOTE_ADDR', 'Unknown')
+        return remote_addr
     
     def _is_valid_public_ip(self, ip):
         """
@@ -341,25 +552,13 @@ class SafaricomIPWhitelist(BasePermission):
         Returns:
             bool: True if valid public IP
         """
-        try:
-            import ipaddress
-            ip_obj = ipaddress.ip_address(ip)
-            
-            # Allow localhost in development
-            if getattr(settings, 'DEBUG', False) and ip_obj.is_loopback:
-                return True
-                
-            # Check if it's a valid public IP
-            return not (ip_obj.is_private or ip_obj.is_loopback or ip_obj.is_multicast)
-        except (ValueError, ImportError):
-            # Basic validation fallback
-            parts = ip.split('.')
-            if len(parts) != 4:
-                return False
-            try:
-                return all(0 <= int(part) <= 255 for part in parts)
-            except ValueError:
-                return False
+        scope = _ip_scope(ip)
+        
+        # Allow localhost in development
+        if scope == 'loopback':
+            return getattr(settings, 'DEBUG', False)
+        
+        return scope == 'public'
 
 
 class HMACSignatureValidator:
@@ -378,7 +577,14 @@ class HMACSignatureValidator:
     Methods:
         validate_signature: Validates HMAC signature of callback data
         generate_signature: Generates HMAC signature for data
+        compute_digest: Computes the raw HMAC digest for data
         is_timestamp_valid: Validates request timestamp
+    
+    Performance:
+        SHA-256 is computed by OpenSSL through hmac.digest(). OpenSSL 1.1.1+
+        uses the CPU's SHA extensions when present (SHA-NI on x86, ARMv8
+        crypto extensions on ARM), so the signature check is cheapest on
+        hosts that have them (check for "sha_ni" / "sha2" in /proc/cpuinfo).
     """
     
     def __init__(self, secret_key=None):
@@ -389,10 +595,13 @@ class HMACSignatureValidator:
             secret_key (str): Secret key for HMAC. If None, uses Django SECRET_KEY
         """
         self.secret_key = secret_key or settings.SECRET_KEY
+        self._key_bytes = self.secret_key.encode('utf-8')  # Encoded once, not per callback
+        # Keyed HMAC with the inner/outer pads already derived; copied per callback
+        self._keyed_mac = hmac.new(self._key_bytes, digestmod=hashlib.sha256)
         self.signature_header = 'HTTP_X_MPESA_SIGNATURE'
         self.timestamp_tolerance = 300  # 5 minutes
     
-    def validate_signature(self, request):
+    def validate_signature(self, request, request_body=None, callback_data=None):
         """
         Validate HMAC signature of incoming callback request.
         
@@ -401,6 +610,11 @@ class HMACSignatureValidator:
         
         Args:
             request (Request): DRF request object
+            request_body (bytes, optional): Raw body if the caller has already
+                                            read it; defaults to request.body
+            callback_data (dict, optional): The body already parsed by the
+                                            caller, read for the payload
+                                            timestamp instead of parsing again
             
         Returns:
             dict: Validation result with status and details
@@ -416,7 +630,8 @@ class HMACSignatureValidator:
                 }
             
             # Get raw request body
-            request_body = request.body
+            if request_body is None:
+                request_body = request.body
             if not request_body:
                 return {
                     'valid': False,
@@ -425,7 +640,7 @@ class HMACSignatureValidator:
                 }
             
             # Extract timestamp if present
-            timestamp = self._extract_timestamp(request)
+            timestamp = self._extract_timestamp(request, request_body, callback_data)
             if timestamp and not self.is_timestamp_valid(timestamp):
                 return {
                     'valid': False,
@@ -433,11 +648,16 @@ class HMACSignatureValidator:
                     'details': 'Request timestamp is outside acceptable range'
                 }
             
-            # Generate expected signature
-            expected_signature = self.generate_signature(request_body, timestamp)
+            # Compare raw 32-byte digests: decode the provided signature once
+            # instead of base64-encoding the expected one
+            try:
+                provided_digest = base64.b64decode(provided_signature, validate=True)
+            except (binascii.Error, ValueError):
+                provided_digest = b''
+            expected_digest = self.compute_digest(request_body, timestamp)
             
             # Compare signatures using secure comparison
-            if self._secure_compare(provided_signature, expected_signature):
+            if self._secure_compare(provided_digest, expected_digest):
                 security_logger.info("HMAC signature validation successful")
                 return {
                     'valid': True,
@@ -470,25 +690,36 @@ class HMACSignatureValidator:
         Returns:
             str: Base64 encoded HMAC signature
         """
+        return base64.b64encode(self.compute_digest(payload, timestamp)).decode('ascii')
+    
+    def compute_digest(self, payload, timestamp=None):
+        """
+        Compute the raw HMAC-SHA256 digest for given payload.
+        
+        Args:
+            payload (bytes): Request payload data
+            timestamp (str, optional): Request timestamp
+            
+        Returns:
+            bytes: 32-byte HMAC digest
+        """
         # Prepare data for signing
         if isinstance(payload, str):
             payload = payload.encode('utf-8')
         
-        # Include timestamp in signature if provided
         if timestamp:
-            data_to_sign = payload + timestamp.encode('utf-8')
+            # Start from a copy of the pre-keyed HMAC, and feed the timestamp
+            # as a second update() rather than copying the whole body into a
+            # payload + timestamp buffer
+            mac = self._keyed_mac.copy()
+            mac.update(payload)
+            mac.update(timestamp.encode('utf-8'))
+            signature = mac.digest()
         else:
-            data_to_sign = payload
+            # One-shot C implementation, no HMAC object
+            signature = hmac.digest(self._key_bytes, payload, 'sha256')
         
-        # Generate HMAC signature
-        signature = hmac.new(
-            key=self.secret_key.encode('utf-8'),
-            msg=data_to_sign,
-            digestmod=hashlib.sha256
-        ).digest()
-        
-        # Return base64 encoded signature
-        return base64.b64encode(signature).decode('utf-8')
+        return signature
     
     def is_timestamp_valid(self, timestamp_str):
         """
@@ -503,15 +734,15 @@ class HMACSignatureValidator:
         try:
             # Try parsing as Unix timestamp first
             try:
-                timestamp = float(timestamp_str)
-                request_time = datetime.fromtimestamp(timestamp)
+                request_timestamp = float(timestamp_str)
             except ValueError:
-                # Try parsing as ISO format
-                request_time = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+                # Try parsing as ISO format (naive values are local time)
+                if timestamp_str.endswith('Z'):
+                    timestamp_str = timestamp_str[:-1] + '+00:00'
+                request_timestamp = datetime.fromisoformat(timestamp_str).timestamp()
             
-            # Check if timestamp is within tolerance
-            current_time = datetime.now()
-            time_diff = abs((current_time - request_time).total_seconds())
+            # Check if timestamp is within tolerance (plain float seconds, no datetimes)
+            time_diff = abs(time.time() - request_timestamp)
             
             return time_diff <= self.timestamp_tolerance
             
@@ -519,12 +750,17 @@ class HMACSignatureValidator:
             security_logger.warning("Timestamp validation error")
             return False
     
-    def _extract_timestamp(self, request):
+    def _extract_timestamp(self, request, request_body, callback_data=None):
         """
         Extract timestamp from request headers or payload.
         
+        The payload is never read through request.data, which would run
+        DRF's parser over a body the caller has usually parsed already.
+        
         Args:
             request (Request): DRF request object
+            request_body (bytes): Raw request body
+            callback_data (dict, optional): Parsed body, if already available
             
         Returns:
             str: Timestamp string or None
@@ -534,12 +770,14 @@ class HMACSignatureValidator:
         if timestamp:
             return timestamp
         
-        # Check JSON payload
-        try:
-            if hasattr(request, 'data') and request.data:
-                return request.data.get('timestamp')
-        except Exception:
-            pass
+        # Check JSON payload, parsing the raw body only if the caller didn't
+        if callback_data is None:
+            try:
+                callback_data = json_loads(request_body)
+            except ValueError:
+                return None
+        if isinstance(callback_data, dict):
+            return callback_data.get('timestamp')
         
         return None
     
@@ -548,8 +786,8 @@ class HMACSignatureValidator:
         Perform secure signature comparison to prevent timing attacks.
         
         Args:
-            provided_sig (str): Signature from request
-            expected_sig (str): Expected signature
+            provided_sig (bytes): Decoded signature from request
+            expected_sig (bytes): Expected digest
             
         Returns:
             bool: True if signatures match
@@ -557,6 +795,87 @@ class HMACSignatureValidator:
         return hmac.compare_digest(provided_sig, expected_sig)
 
 
+# One required field's rules, flattened out of the schema dict. path is the
+# dotted path used in error messages; parent is the index of the enclosing
+# object's rule (None at top level).
+_FieldRule = namedtuple('_FieldRule', 'name path parent expected_type max_length min_value')
+
+
+def _compile_field_rules(field_schema, parent_path='', parent=None, rules=None):
+    """
+    Flatten a REQUIRED_STK_FIELDS-style schema into a list of _FieldRule.
+    
+    The schema dict is walked once, up front, in parent-before-child order,
+    so validating a callback is a single flat loop with no dict lookups on
+    the schema and no path building.
+    
+    Args:
+        field_schema (dict): Field name -> rules ('type', 'max_length',
+                             'min_value', 'nested')
+        parent_path (str): Dotted path of the enclosing object
+        parent (int): Index of the enclosing object's rule
+        rules (list): Rules collected so far (used by the recursion)
+        
+    Returns:
+        tuple: _FieldRule entries, parents before their children
+    """
+    if rules is None:
+        rules = []
+    for field_name, field_rules in field_schema.items():
+        path = f"{parent_path}.{field_name}" if parent_path else field_name
+        rules.append(_FieldRule(
+            field_name,
+            path,
+            parent,
+            field_rules.get('type'),
+            field_rules.get('max_length'),
+            field_rules.get('min_value'),
+        ))
+        if 'nested' in field_rules:
+            _compile_field_rules(field_rules['nested'], path, len(rules) - 1, rules)
+    return tuple(rules)
+
+
+def _check_field_rules(rules, data, errors):
+    """
+    Check data against compiled field rules, appending messages to errors.
+    
+    Children of a field that is missing, mistyped or not an object are
+    skipped. Messages are only formatted on the error branches.
+    """
+    # Value of each rule's field, or None if its children shouldn't be checked
+    values = [None] * len(rules)
+    for index, (field_name, path, parent, expected_type, max_length, min_value) in enumerate(rules):
+        container = data if parent is None else values[parent]
+        if container is None:
+            continue
+        
+        if field_name not in container:
+            errors.append(f"Missing required field: {path}")
+            continue
+        
+        field_value = container[field_name]
+        
+        # Type validation
+        if expected_type and not isinstance(field_value, expected_type):
+            errors.append(
+                f"Invalid type for {path}: expected {expected_type.__name__}, got {type(field_value).__name__}"
+            )
+            continue
+        
+        # Length validation for strings
+        if max_length and isinstance(field_value, str) and len(field_value) > max_length:
+            errors.append(f"Field {path} exceeds maximum length of {max_length}")
+        
+        # Value validation for integers
+        if min_value is not None and isinstance(field_value, int) and field_value < min_value:
+            errors.append(f"Field {path} below minimum value of {min_value}")
+        
+        # Only objects can hold nested fields
+        if isinstance(field_value, dict):
+            values[index] = field_value
+
+
 class CallbackStructureValidator:
     """
     Validates the structure and content of M-Pesa callback payloads.
@@ -613,6 +932,9 @@ class CallbackStructureValidator:
         }
     }
     
+    # REQUIRED_STK_FIELDS flattened once at import
+    _REQUIRED_STK_RULES = _compile_field_rules(REQUIRED_STK_FIELDS)
+    
     def __init__(self, callback_type='stk_push'):
         """
         Initialize validator for specific callback type.
@@ -633,7 +955,9 @@ class CallbackStructureValidator:
         Returns:
             dict: Validation result with status and details
         """
-        self.validation_errors = []
+        # Errors are collected in a local list so one validator instance can be
+        # shared across concurrent requests; validation_errors keeps the latest
+        errors = self.validation_errors = []
         
         try:
             if not isinstance(callback_data, dict):
@@ -644,19 +968,19 @@ class CallbackStructureValidator:
                 }
             
             # Validate required fields
-            self._validate_required_fields(callback_data, self.REQUIRED_STK_FIELDS)
+            _check_field_rules(self._REQUIRED_STK_RULES, callback_data, errors)
             
             # Validate optional fields if present
             self._validate_optional_fields(callback_data, self.OPTIONAL_STK_FIELDS)
             
             # Additional business logic validation
-            self._validate_business_rules(callback_data)
+            self._validate_business_rules(callback_data, errors)
             
-            if self.validation_errors:
+            if errors:
                 return {
                     'valid': False,
                     'error': 'Structure validation failed',
-                    'details': self.validation_errors
+                    'details': errors
                 }
             
             return {
@@ -673,48 +997,13 @@ class CallbackStructureValidator:
                 'details': 'Unable to validate structure'
             }
     
-    def _validate_required_fields(self, data, field_schema, path=''):
-        """Validate required fields recursively."""
-        for field_name, field_rules in field_schema.items():
-            current_path = f"{path}.{field_name}" if path else field_name
-            
-            if field_name not in data:
-                self.validation_errors.append(f"Missing required field: {current_path}")
-                continue
-            
-            field_value = data[field_name]
-            
-            # Type validation
-            expected_type = field_rules.get('type')
-            if expected_type and not isinstance(field_value, expected_type):
-                self.validation_errors.append(
-                    f"Invalid type for {current_path}: expected {expected_type.__name__}, got {type(field_value).__name__}"
-                )
-                continue
-            
-            # Length validation for strings
-            if isinstance(field_value, str):
-                max_length = field_rules.get('max_length')
-                if max_length and len(field_value) > max_length:
-                    self.validation_errors.append(f"Field {current_path} exceeds maximum length of {max_length}")
-            
-            # Value validation for integers
-            if isinstance(field_value, int):
-                min_value = field_rules.get('min_value')
-                if min_value is not None and field_value < min_value:
-                    self.validation_errors.append(f"Field {current_path} below minimum value of {min_value}")
-            
-            # Nested validation
-            if 'nested' in field_rules and isinstance(field_value, dict):
-                self._validate_required_fields(field_value, field_rules['nested'], current_path)
-    
     def _validate_optional_fields(self, data, field_schema):
         """Validate optional fields if present."""
         # Implementation would be similar to required fields but skip missing fields
         pass
     
-    def _validate_business_rules(self, callback_data):
-        """Validate business-specific rules."""
+    def _validate_business_rules(self, callback_data, errors):
+        """Validate business-specific rules, appending messages to errors."""
         try:
             # Extract callback details
             stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
@@ -722,17 +1011,17 @@ class CallbackStructureValidator:
             
             # Validate result code is within expected range
             if result_code is not None and not (0 <= result_code <= 9999):
-                self.validation_errors.append(f"Invalid result code: {result_code}")
+                errors.append(f"Invalid result code: {result_code}")
             
             # Validate MerchantRequestID format (should be alphanumeric)
             merchant_id = stk_callback.get('MerchantRequestID', '')
             if merchant_id and not merchant_id.replace('-', '').replace('_', '').isalnum():
-                self.validation_errors.append("Invalid MerchantRequestID format")
+                errors.append("Invalid MerchantRequestID format")
             
             # Additional validations can be added here
             
         except Exception as e:
-            self.validation_errors.append("Business rule validation error occurred")
+            errors.append("Business rule validation error occurred")
     
     def sanitize_data(self, callback_data):
         """
@@ -745,29 +1034,21 @@ class CallbackStructureValidator:
             dict: Sanitized callback data
         """
         try:
-            # Deep copy to avoid modifying original
-            sanitized = json.loads(json.dumps(callback_data))
-            
-            # Sanitize string fields
-            self._sanitize_strings(sanitized)
-            
-            return sanitized
+            # Build the sanitized copy in a single pass (the original is left untouched)
+            return self._sanitize_value(callback_data)
         except Exception:
             return callback_data
     
-    def _sanitize_strings(self, data):
-        """Recursively sanitize string values."""
-        if isinstance(data, dict):
-            for key, value in data.items():
-                if isinstance(value, str):
-                    # Basic sanitization - remove potential script tags and normalize whitespace
-                    data[key] = value.strip()[:1000]  # Limit length and trim whitespace
-                elif isinstance(value, (dict, list)):
-                    self._sanitize_strings(value)
-        elif isinstance(data, list):
-            for item in data:
-                if isinstance(item, (dict, list)):
-                    self._sanitize_strings(item)
+    def _sanitize_value(self, value):
+        """Recursively copy a value, sanitizing string values along the way."""
+        if isinstance(value, str):
+            # Basic sanitization - limit length and trim whitespace
+            return value.strip()[:1000]
+        if isinstance(value, dict):
+            return {key: self._sanitize_value(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._sanitize_value(item) for item in value]
+        return value
 
 
 class EnhancedCallbackSecurity:
@@ -788,6 +1069,9 @@ class EnhancedCallbackSecurity:
         get_security_context: Extract security context from request
     """
     
+    # Credential headers never copied into the security context
+    EXCLUDED_HEADERS = frozenset({'HTTP_AUTHORIZATION', 'HTTP_PROXY_AUTHORIZATION', 'HTTP_COOKIE'})
+    
     def __init__(self, enable_hmac=True, enable_structure_validation=True):
         """
         Initialize enhanced security system.
@@ -805,10 +1089,23 @@ class EnhancedCallbackSecurity:
         Comprehensive callback validation using multiple security layers.
         
         This method applies all enabled security validations in sequence:
-        1. IP whitelisting
+        1. Rate limiting and IP whitelisting (headers only, reused from the
+           permission check when it already ran for this request), then a
+           cheap check that this is a non-empty JSON POST
         2. HMAC signature validation (if enabled)
         3. Structure validation (if enabled)
-        4. Rate limiting
+        
+        The request body is only read from step 2 onwards, so requests
+        rejected by IP or rate limit never have their body buffered. It is
+        then read and parsed once, before the HMAC check (which needs the
+        payload timestamp when no X-Timestamp header is sent); the parsed
+        payload is returned as 'callback_data' so the caller doesn't decode
+        it again.
+        
+        The HMAC and structure layers run inline, one after the other: both
+        are a few microseconds of in-memory CPU work with no I/O, so running
+        them concurrently (threads or asyncio) would cost more in scheduling
+        than it could save.
         
         Args:
             request (Request): DRF request object
@@ -837,9 +1134,40 @@ class EnhancedCallbackSecurity:
                 validation_results['rejection_reason'] = 'IP not whitelisted'
                 return validation_results
             
+            # M-Pesa only sends JSON POSTs; turn away probes before hashing or parsing.
+            # Media types are case-insensitive (Application/JSON is valid)
+            if (request.method != 'POST'
+                    or not request.META.get('CONTENT_TYPE', '').lower().startswith('application/json')):
+                validation_results['overall_status'] = 'rejected'
+                validation_results['rejection_reason'] = 'Invalid method or content type'
+                return validation_results
+            
+            request_body = request.body
+            if not request_body:
+                validation_results['overall_status'] = 'rejected'
+                validation_results['rejection_reason'] = 'Empty request body'
+                return validation_results
+            
+            # Parse the body once: the HMAC layer reads the payload timestamp
+            # from it and the structure layer validates it
+            try:
+                callback_data = json_loads(request_body)
+            except json.JSONDecodeError as e:
+                validation_results['validations']['structure'] = {
+                    'valid': False,
+                    'error': 'Invalid JSON',
+                    'details': str(e)
+                }
+                validation_results['overall_status'] = 'rejected'
+                validation_results['rejection_reason'] = 'Invalid JSON payload'
+                return validation_results
+            validation_results['callback_data'] = callback_data
+            
             # Layer 2: HMAC Signature Validation (if enabled)
             if self.hmac_validator:
-                hmac_result = self.hmac_validator.validate_signature(request)
+                hmac_result = self.hmac_validator.validate_signature(
+                    request, request_body, callback_data
+                )
                 validation_results['validations']['hmac_signature'] = hmac_result
                 
                 if not hmac_result['valid']:
@@ -849,23 +1177,12 @@ class EnhancedCallbackSecurity:
             
             # Layer 3: Structure Validation (if enabled)
             if self.structure_validator:
-                try:
-                    callback_data = json.loads(request.body) if request.body else {}
-                    structure_result = self.structure_validator.validate_structure(callback_data)
-                    validation_results['validations']['structure'] = structure_result
-                    
-                    if not structure_result['valid']:
-                        validation_results['overall_status'] = 'rejected'
-                        validation_results['rejection_reason'] = 'Structure validation failed'
-                        return validation_results
-                except json.JSONDecodeError as e:
-                    validation_results['validations']['structure'] = {
-                        'valid': False,
-                        'error': 'Invalid JSON',
-                        'details': str(e)
-                    }
+                structure_result = self.structure_validator.validate_structure(callback_data)
+                validation_results['validations']['structure'] = structure_result
+                
+                if not structure_result['valid']:
                     validation_results['overall_status'] = 'rejected'
-                    validation_results['rejection_reason'] = 'Invalid JSON payload'
+                    validation_results['rejection_reason'] = 'Structure validation failed'
                     return validation_results
             
             # All validations passed
@@ -889,22 +1206,33 @@ class EnhancedCallbackSecurity:
         """
         Extract comprehensive security context from request.
         
+        The context is built once per request and stored on it, so later
+        callers don't rescan request.META.
+        
         Args:
             request (Request): DRF request object
             
         Returns:
             dict: Security context information
         """
-        return {
+        context = vars(request).get('_mpesa_security_context')
+        if context is not None:
+            return context
+        
+        meta = request.META
+        excluded = self.EXCLUDED_HEADERS
+        context = {
             'client_ip': self.ip_whitelist.get_client_ip(request),
-            'user_agent': request.META.get('HTTP_USER_AGENT', 'Unknown'),
+            'user_agent': meta.get('HTTP_USER_AGENT', 'Unknown'),
             'method': request.method,
             'path': request.path,
-            'timestamp': datetime.now().isoformat(),
-            'content_type': request.META.get('CONTENT_TYPE', ''),
-            'content_length': request.META.get('CONTENT_LENGTH', 0),
+            'timestamp': time.time(),  # Unix time; format with datetime.fromtimestamp() if needed
+            'content_type': meta.get('CONTENT_TYPE', ''),
+            'content_length': meta.get('CONTENT_LENGTH', 0),
             'headers': {
-                k: v for k, v in request.META.items() 
-                if k.startswith('HTTP_') and 'AUTHORIZATION' not in k
+                k: v for k, v in meta.items()
+                if k[:5] == 'HTTP_' and k not in excluded
             }
-        }
\ No newline at end of file
+        }
+        request._mpesa_security_context = context
+        return context
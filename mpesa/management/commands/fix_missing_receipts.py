@@ -9,7 +9,7 @@ from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 from mpesa.models import Transaction
 from mpesa.stk_push import MpesaGateWay
-import time
+from mpesa.utils import TokenBucket
 
 
 class Command(BaseCommand):
@@ -48,13 +48,14 @@ class Command(BaseCommand):
         # Find completed transactions without receipt numbers in the last N days
         cutoff_date = timezone.now() - timezone.timedelta(days=days)
         
-        missing_receipts = Transaction.objects.filter(
+        # Evaluated once; the list is reused for the counts and the loop
+        missing_receipts = list(Transaction.objects.filter(
             status="0",  # Completed
             receipt_no__isnull=True,  # Missing receipt
             created__gte=cutoff_date  # Within date range
-        ).order_by('-created')[:limit]
+        ).order_by('-created')[:limit])
         
-        if not missing_receipts.exists():
+        if not missing_receipts:
             self.stdout.write(
                 self.style.SUCCESS(
                     '✅ No completed transactions missing receipt numbers found!'
@@ -63,7 +64,7 @@ class Command(BaseCommand):
             return
             
         self.stdout.write(
-            f'Found {missing_receipts.count()} transactions missing receipt numbers'
+            f'Found {len(missing_receipts)} transactions missing receipt numbers'
         )
         
         if dry_run:
@@ -79,6 +80,10 @@ class Command(BaseCommand):
         
         fixed_count = 0
         failed_count = 0
+        # Transactions with a receipt found, saved together after the loop
+        to_update = []
+        # Respect Daraja rate limits: short bursts, 2 queries/second on average
+        rate_limiter = TokenBucket(capacity=5, refill_per_sec=2.0)
         
         for transaction in missing_receipts:
             self.stdout.write(f'\n📋 Processing transaction {transaction.transaction_no}')
@@ -90,6 +95,7 @@ class Command(BaseCommand):
                 # Query M-Pesa for transaction details
                 self.stdout.write('   🔍 Querying M-Pesa API...')
                 
+                rate_limiter.acquire()
                 query_result = gateway.stk_push_query(transaction.checkout_request_id)
                 
                 if (query_result and 
@@ -107,8 +113,8 @@ class Command(BaseCommand):
                         
                         if not dry_run:
                             transaction.receipt_no = receipt_no
-                            transaction.save(update_fields=['receipt_no'])
-                            self.stdout.write('   💾 Receipt number saved!')
+                            to_update.append(transaction)
+                            self.stdout.write('   💾 Receipt number queued for saving')
                         else:
                             self.stdout.write('   🧪 Would save receipt number')
                             
@@ -130,15 +136,17 @@ class Command(BaseCommand):
                     self.style.ERROR(f'   ❌ Error querying transaction: {e}')
                 )
                 failed_count += 1
-            
-            # Add small delay to respect rate limits
-            time.sleep(0.5)
+        
+        # One batched UPDATE instead of a save() per transaction
+        if to_update:
+            Transaction.objects.bulk_update(to_update, ['receipt_no'], batch_size=100)
+            self.stdout.write(self.style.SUCCESS(f'\n💾 Saved {len(to_update)} receipt numbers'))
         
         # Summary
         self.stdout.write('\n' + '='*50)
         self.stdout.write(self.style.SUCCESS('📊 SUMMARY'))
         self.stdout.write('='*50)
-        self.stdout.write(f'Transactions processed: {missing_receipts.count()}')
+        self.stdout.write(f'Transactions processed: {len(missing_receipts)}')
         self.stdout.write(self.style.SUCCESS(f'Successfully fixed: {fixed_count}'))
         self.stdout.write(self.style.ERROR(f'Failed to fix: {failed_count}'))
         
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-16 02:57
+
+import phonenumber_field.modelfields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0004_alter_transaction_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='phone_number',
+            field=phonenumber_field.modelfields.PhoneNumberField(db_index=True, max_length=128, region=None),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='receipt_no',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.CharField(choices=[('1', 'Pending'), ('0', 'Complete'), ('2', 'Failed'), ('3', 'Cancelled'), ('4', 'Timeout')], db_index=True, default=1, max_length=15),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-created', 'status'], name='txn_created_status_idx'),
+        ),
+    ]
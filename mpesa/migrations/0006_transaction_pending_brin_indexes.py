@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-16 03:03
+
+from django.db import migrations, models
+
+
+def create_brin_index(apps, schema_editor):
+    """BRIN index on created for time-range scans (PostgreSQL only)."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS txn_created_brin_idx '
+        'ON mpesa_transaction USING brin (created)'
+    )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS txn_created_brin_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0005_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('status', '1')), fields=['-created'], name='txn_pending_created_idx'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
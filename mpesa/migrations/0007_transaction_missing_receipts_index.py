@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-16 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0006_transaction_pending_brin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('receipt_no__isnull', True), ('status', '0')), fields=['-created'], name='txn_missing_receipts_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0007_transaction_missing_receipts_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='checkout_request_id',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-16 03:21
+
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+
+def normalize_amounts(apps, schema_editor):
+    """Rewrite stored amount strings as plain decimals so the column can be cast."""
+    Transaction = apps.get_model('mpesa', 'Transaction')
+    for pk, amount in Transaction.objects.values_list('pk', 'amount').iterator():
+        try:
+            value = Decimal((amount or '').strip())
+            if not value.is_finite():
+                raise InvalidOperation
+            normalized = str(value.quantize(Decimal('0.01')))
+        except InvalidOperation:
+            normalized = '0.00'
+        if normalized != amount:
+            Transaction.objects.filter(pk=pk).update(amount=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0008_transaction_checkout_request_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_amounts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=12),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-16 03:24
+
+import uuid
+from django.db import migrations, models
+
+
+def normalize_transaction_numbers(apps, schema_editor):
+    """
+    Rewrite stored transaction numbers in the form the uuid column expects.
+    
+    PostgreSQL casts the existing hyphenated strings itself; other backends
+    store UUIDs as 32-char hex, so the hyphens are dropped there. Values that
+    aren't UUIDs at all get a fresh one.
+    """
+    Transaction = apps.get_model('mpesa', 'Transaction')
+    native_uuid = schema_editor.connection.vendor == 'postgresql'
+    for pk, transaction_no in Transaction.objects.values_list('pk', 'transaction_no').iterator():
+        try:
+            value = uuid.UUID(str(transaction_no))
+        except ValueError:
+            value = uuid.uuid4()
+        normalized = str(value) if native_uuid else value.hex
+        if normalized != transaction_no:
+            Transaction.objects.filter(pk=pk).update(transaction_no=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0009_transaction_amount_decimal'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_transaction_numbers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_no',
+            field=models.UUIDField(default=uuid.uuid4, unique=True),
+        ),
+    ]
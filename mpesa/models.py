@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.db.models import Q
 from phonenumber_field.modelfields import PhoneNumberField
 
 # Status choices for transaction - using string values for consistency
@@ -19,14 +20,15 @@ class Transaction(models.Model):
     phone numbers, amounts, and M-Pesa specific identifiers.
     """
     
-    # Unique transaction identifier generated automatically
-    transaction_no = models.CharField(default=uuid.uuid4, max_length=50, unique=True)
+    # Unique transaction identifier generated automatically (native uuid
+    # column on PostgreSQL, 32-char hex elsewhere)
+    transaction_no = models.UUIDField(default=uuid.uuid4, unique=True)
     
     # Customer phone number (validated using phonenumbers library)
-    phone_number = PhoneNumberField(null=False, blank=False)
+    phone_number = PhoneNumberField(null=False, blank=False, db_index=True)
     
-    # M-Pesa checkout request ID from Safaricom API
-    checkout_request_id = models.CharField(max_length=200)
+    # M-Pesa checkout request ID from Safaricom API (callbacks and status checks look rows up by it)
+    checkout_request_id = models.CharField(max_length=200, db_index=True)
     
     # Optional payment reference for customer identification
     reference = models.CharField(max_length=40, blank=True)
@@ -34,17 +36,18 @@ class Transaction(models.Model):
     # Optional description of what the payment is for
     description = models.TextField(null=True, blank=True)
     
-    # Transaction amount stored as string to maintain precision
-    amount = models.CharField(max_length=10)
+    # Transaction amount in KES; a decimal column keeps precision and lets the
+    # database compare and sum amounts natively
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
     
     # Transaction status: "1" = Pending, "0" = Complete
-    status = models.CharField(max_length=15, choices=STATUS, default=1)
+    status = models.CharField(max_length=15, choices=STATUS, default=1, db_index=True)
     
     # M-Pesa receipt number (only available after successful payment)
-    receipt_no = models.CharField(max_length=200, blank=True, null=True)
+    receipt_no = models.CharField(max_length=200, blank=True, null=True, db_index=True)
     
     # Timestamp when transaction was created
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
     
     # Timestamp when transaction was last updated
     updated_at = models.DateTimeField(auto_now=True)
@@ -52,6 +55,21 @@ class Transaction(models.Model):
     # IP address of the customer who initiated the transaction
     ip = models.CharField(max_length=200, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Matches the admin's default ordering (newest first) filtered by status
+            models.Index(fields=['-created', 'status'], name='txn_created_status_idx'),
+            # Only the unfinished tail, for the admin's "Pending" status filter
+            models.Index(fields=['-created'], condition=Q(status='1'), name='txn_pending_created_idx'),
+            # Completed rows still missing a receipt, for the fix_missing_receipts scan
+            models.Index(
+                fields=['-created'],
+                condition=Q(status='0', receipt_no__isnull=True),
+                name='txn_missing_receipts_idx',
+            ),
+        ]
+        # PostgreSQL also gets a BRIN index on created (see migration 0006)
+
     def __unicode__(self):
         """Unicode representation for Python 2 compatibility."""
         return f"{self.transaction_no}"
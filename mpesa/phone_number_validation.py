@@ -7,6 +7,7 @@ numbers are accepted for payment processing.
 
 Components:
     - validate_possible_number: Core validation function for phone numbers
+    - KENYA_REGION: Region code passed by the M-Pesa callers
     - Integration with phonenumbers library for international validation
     - Custom error handling with payment-specific error codes
 
@@ -16,6 +17,7 @@ Validation Features:
     - Phone number possibility checking
     - Phone number validity verification
     - Custom error messages for payment context
+    - Results cached per (phone, country) string pair
 
 Dependencies:
     - phonenumbers library for comprehensive validation
@@ -31,6 +33,7 @@ Date: 2024
 """
 
 from enum import Enum
+from functools import lru_cache
 
 from django.core.exceptions import ValidationError
 from phonenumber_field.phonenumber import to_python
@@ -38,6 +41,10 @@ from phonenumbers.phonenumberutil import is_possible_number
 
 from .error_codes import PaymentErrorCode
 
+# Region used for every M-Pesa number. Passing this one constant everywhere
+# keeps the (phone, country) cache keys below identical across callers
+KENYA_REGION = "KE"
+
 
 def validate_possible_number(phone, country=None):
     """
@@ -69,6 +76,44 @@ def validate_possible_number(phone, country=None):
     Note:
         This validation is specifically designed for M-Pesa which requires
         valid Kenyan phone numbers (Safaricom network primarily).
+        
+        String inputs are cached, so repeat customers skip the phonenumbers
+        metadata lookups; the returned object may be shared between calls
+        and must not be modified.
+    """
+    if isinstance(phone, str):
+        phone_number = _parse_valid_number(phone, country)
+    else:
+        # PhoneNumber objects aren't hashable, so they bypass the cache
+        phone_number = _parse_valid_number.__wrapped__(phone, country)
+    
+    if phone_number is None:
+        # Raise validation error with payment-specific error code
+        raise ValidationError(
+            "The phone number entered is not valid.", 
+            code=PaymentErrorCode.INVALID
+        )
+    
+    # Return validated phone number object
+    return phone_number
+
+
+@lru_cache(maxsize=4096)
+def _parse_valid_number(phone, country):
+    """
+    Parse a phone number and run the possibility and validity checks.
+    
+    Args:
+        phone (str): Phone number string to validate
+        country (str): Country code for validation context, or None
+        
+    Returns:
+        PhoneNumber: Validated phone number object, or None if invalid
+        
+    Note:
+        lru_cache is thread-safe, so the cache can be shared by all worker
+        threads. Two threads missing on the same number may both parse it,
+        which is harmless because the result is the same.
     """
     # Convert string to standardized phone number object
     phone_number = to_python(phone, country)
@@ -79,11 +124,5 @@ def validate_possible_number(phone, country=None):
         or not is_possible_number(phone_number)  # Number format impossible
         or not phone_number.is_valid()  # Number doesn't pass validity rules
     ):
-        # Raise validation error with payment-specific error code
-        raise ValidationError(
-            "The phone number entered is not valid.", 
-            code=PaymentErrorCode.INVALID
-        )
-    
-    # Return validated phone number object
-    return phone_number
\ No newline at end of file
+        return None
+    return phone_number
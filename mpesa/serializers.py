@@ -1,34 +1,128 @@
 # Import phone number validation utilities
-from .phone_number_validation import validate_possible_number
+from .phone_number_validation import KENYA_REGION, validate_possible_number
 from rest_framework import serializers
 from django.core.exceptions import ValidationError
 import re
-import html
-import bleach
+import string
 from decimal import Decimal, InvalidOperation
+from functools import lru_cache
 
 from . import models
 
 
-class MpesaCheckoutSerializer(serializers.ModelSerializer):
+# Allowed characters, built once at import. Inputs must also be ASCII, so a
+# set membership test replaces a regex character-class match
+_PHONE_CHARS = frozenset(string.digits + string.whitespace + '-()+')
+_REF_CHARS = frozenset(string.ascii_letters + string.digits + string.whitespace + '-_.')
+_DESC_CHARS = frozenset(string.ascii_letters + string.digits + string.whitespace + '-_.,!?')
+
+# Deletes the separators _PHONE_CHARS lets through (whitespace, -, ( and )),
+# leaving only digits and +; str.translate does this in one C-level pass
+_PHONE_SEPARATORS = str.maketrans('', '', string.whitespace + '-()')
+
+# Cleaned Kenyan number: optional +, optional 254 or 0 prefix, then the
+# 9-digit subscriber number
+_PHONE_NORM = re.compile(r'^\+?(?:254|0)?(\d{9})$')
+
+# Amount limits (KES), parsed once instead of on every validate_amount call
+_MAX_MPESA = Decimal('300000.00')  # M-Pesa per-transaction limit
+_MIN_AMOUNT = Decimal('1.00')
+_CENTS = Decimal('0.01')  # Smallest currency unit
+
+@lru_cache(maxsize=None)
+def _bleach():
+    """
+    Import bleach on first use.
+    
+    Plain-text references and descriptions never reach bleach, so workers
+    only load it (and html5lib) once a value with markup turns up.
+    
+    Returns:
+        module: The bleach module
+    """
+    import bleach
+    return bleach
+
+
+def _validate_text(value, label, max_len, allowed_chars, default="Payment"):
+    """
+    Shared validation for the free-text checkout fields.
+    
+    Args:
+        value (str): Raw field value
+        label (str): Field name used in error messages (e.g. "Reference")
+        max_len (int): Maximum length after stripping whitespace
+        allowed_chars (frozenset): Characters the value may contain
+        default (str): Value returned when the field is empty
+        
+    Returns:
+        str: Validated and sanitized value
+        
+    Raises:
+        serializers.ValidationError: If the value is too long or contains
+            characters outside allowed_chars
+    """
+    if not value:
+        return default
+    
+    # Convert to string and sanitize (DRF's CharField already hands us a str)
+    if type(value) is not str:
+        value = str(value)
+    value = value.strip()
+    
+    # Security: Limit length to prevent abuse
+    if len(value) > max_len:
+        raise serializers.ValidationError(f"{label} too long (max {max_len} characters)")
+    
+    # Plain text needs no sanitizing: the allowed sets have no <, >, &, " or '
+    if value and value.isascii() and allowed_chars.issuperset(value):
+        return value
+    
+    # Security: Remove HTML and script tags (bleach also escapes any
+    # leftover &, < and >, which the character check below then rejects)
+    value = _bleach().clean(value, tags=[], attributes={}, strip=True)
+    
+    if not value or not value.isascii() or not allowed_chars.issuperset(value):
+        raise serializers.ValidationError(f"{label} contains invalid characters")
+    
+    return value
+
+
+# Standalone DRF fields reused by TransactionSerializer.to_representation so
+# amounts and timestamps are formatted exactly as the declared fields would
+_AMOUNT_FIELD = serializers.DecimalField(max_digits=12, decimal_places=2)
+_DATETIME_FIELD = serializers.DateTimeField()
+
+# Maximum input lengths
+_MAX_LEN_PHONE = 20
+_MAX_LEN_REF = 50
+_MAX_LEN_DESC = 100
+
+
+class MpesaCheckoutSerializer(serializers.Serializer):
     """
     Serializer for M-Pesa checkout requests.
     
     This serializer validates and processes payment request data including
     phone number formatting, amount validation, and optional reference/description fields.
+    
+    It only validates input (the gateway creates the Transaction), so the
+    fields are declared directly instead of being derived from the model by
+    ModelSerializer. They mirror the Transaction columns they end up in;
+    length and character limits are enforced by the validate_* methods.
     """
     
-    # Override PhoneNumberField to use custom validation
+    # Customer's phone number (plain string; normalized by validate_phone_number)
     phone_number = serializers.CharField()
     
-    class Meta:
-        model = models.Transaction
-        fields = (
-            "phone_number",  # Customer's phone number
-            "amount",        # Payment amount in KES
-            "reference",     # Optional payment reference
-            "description",   # Optional payment description
-        )
+    # Payment amount in KES (matches Transaction.amount)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    
+    # Optional payment reference (Transaction.reference is 40 characters)
+    reference = serializers.CharField(required=False, allow_blank=True, max_length=40)
+    
+    # Optional payment description
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
 
     def validate_phone_number(self, phone_number):
         """
@@ -43,31 +137,52 @@ class MpesaCheckoutSerializer(serializers.ModelSerializer):
         Raises:
             serializers.ValidationError: If phone number is invalid
         """
-        # Input sanitization
-        phone_number = str(phone_number).strip()
+        # Fast path: already in canonical 254XXXXXXXXX form, nothing to clean
+        if (type(phone_number) is str and len(phone_number) == 12
+                and phone_number.startswith('254') and phone_number.isascii()
+                and phone_number.isdigit()):
+            return self._validate_kenyan_number(phone_number)
+        
+        # Input sanitization (DRF's CharField already hands us a str)
+        if type(phone_number) is not str:
+            phone_number = str(phone_number)
+        phone_number = phone_number.strip()
         
         # Security: Prevent injection attacks by limiting input length
-        if len(phone_number) > 20:
+        if len(phone_number) > _MAX_LEN_PHONE:
             raise serializers.ValidationError("Phone number too long")
         
         # Security: Only allow digits, +, spaces, hyphens, and parentheses
-        if not re.match(r'^[\d\s\-\(\)\+]+$', phone_number):
+        if not phone_number or not phone_number.isascii() or not _PHONE_CHARS.issuperset(phone_number):
             raise serializers.ValidationError("Phone number contains invalid characters")
         
         # Remove any non-digit characters except + symbol
-        phone_number = re.sub(r'[^\d+]', '', phone_number)
+        phone_number = phone_number.translate(_PHONE_SEPARATORS)
+        
+        # Handle international (+254...), local (0XXX) and bare national
+        # formats in one match, keeping the 9-digit subscriber number
+        match = _PHONE_NORM.match(phone_number)
+        if not match:
+            raise serializers.ValidationError("Invalid phone number format")
+            
+        return self._validate_kenyan_number("254" + match.group(1))
+
+    def _validate_kenyan_number(self, phone_number):
+        """
+        Check a normalized phone number with the phonenumbers library.
         
-        # Handle international format (+254...)
-        if phone_number.startswith("+"):
-            phone_number = phone_number[1:]  # Remove '+' prefix
+        Args:
+            phone_number (str): Phone number with separators and prefixes removed
             
-        # Convert local format (0XXX) to international (254XXX)
-        if phone_number.startswith("0"):
-            phone_number = "254" + phone_number[1:]
+        Returns:
+            str: The same phone number if it is a valid Kenyan number
             
+        Raises:
+            serializers.ValidationError: If phone number is invalid
+        """
         try:
             # Validate using phonenumbers library with Kenya region
-            result = validate_possible_number(phone_number, "KE")
+            result = validate_possible_number(phone_number, KENYA_REGION)
             return phone_number  # Return the processed phone number
         except ValidationError as e:
             raise serializers.ValidationError("Invalid phone number format")
@@ -88,31 +203,26 @@ class MpesaCheckoutSerializer(serializers.ModelSerializer):
             serializers.ValidationError: If amount is invalid or out of range
         """
         try:
-            # Convert to Decimal for precise financial calculations
-            amount_decimal = Decimal(str(amount))
+            # Convert to Decimal for precise financial calculations (the
+            # model's DecimalField has usually done this already)
+            if isinstance(amount, Decimal):
+                amount_decimal = amount
+            else:
+                amount_decimal = Decimal(str(amount))
             
-            # Security: Check for negative amounts
-            if amount_decimal <= 0:
-                raise serializers.ValidationError("Amount must be greater than zero")
-                
-            # Security: Check for unreasonably large amounts (prevent overflow)
-            if amount_decimal > Decimal('999999.99'):
-                raise serializers.ValidationError("Amount exceeds maximum limit")
-                
-            # M-Pesa specific validation (KES 300,000 limit)
-            if amount_decimal > Decimal('300000.00'):
-                raise serializers.ValidationError("Amount exceeds M-Pesa transaction limit")
-                
-            # Check minimum amount (KES 1)
-            if amount_decimal < Decimal('1.00'):
-                raise serializers.ValidationError("Minimum amount is KES 1")
+            # Security: One range check covers non-positive, below-minimum and
+            # over-limit amounts (M-Pesa caps a transaction at KES 300,000)
+            if amount_decimal < _MIN_AMOUNT or amount_decimal > _MAX_MPESA:
+                raise serializers.ValidationError("Amount out of range (1 - 300000 KES)")
                 
             # Check decimal places (max 2 for currency)
-            if amount_decimal.as_tuple().exponent < -2:
+            if amount_decimal != amount_decimal.quantize(_CENTS):
                 raise serializers.ValidationError("Amount cannot have more than 2 decimal places")
                 
             return amount_decimal
             
+        except serializers.ValidationError:
+            raise
         except (InvalidOperation, ValueError):
             raise serializers.ValidationError("Invalid amount format")
         except Exception:
@@ -122,65 +232,31 @@ class MpesaCheckoutSerializer(serializers.ModelSerializer):
         """
         Validate and sanitize payment reference with security checks.
         
+        Only alphanumeric characters, whitespace, hyphens, underscores and
+        dots are allowed.
+        
         Args:
             reference (str): Optional payment reference
             
         Returns:
             str: Validated and sanitized reference
         """
-        if not reference:
-            return "Payment"  # Default reference
-        
-        # Convert to string and sanitize
-        reference = str(reference).strip()
-        
-        # Security: Limit length to prevent abuse
-        if len(reference) > 50:
-            raise serializers.ValidationError("Reference too long (max 50 characters)")
-        
-        # Security: Remove HTML and script tags
-        reference = bleach.clean(reference, tags=[], attributes={}, strip=True)
-        
-        # Security: Escape HTML entities
-        reference = html.escape(reference)
-        
-        # Security: Only allow alphanumeric, spaces, hyphens, and underscores
-        if not re.match(r'^[a-zA-Z0-9\s\-_\.]+$', reference):
-            raise serializers.ValidationError("Reference contains invalid characters")
-            
-        return reference
+        return _validate_text(reference, "Reference", _MAX_LEN_REF, _REF_CHARS)
 
     def validate_description(self, description):
         """
         Validate and sanitize payment description with security checks.
         
+        Only alphanumeric characters, whitespace and basic punctuation are
+        allowed.
+        
         Args:
             description (str): Optional payment description
             
         Returns:
             str: Validated and sanitized description
         """
-        if not description:
-            return "Payment"  # Default description
-        
-        # Convert to string and sanitize
-        description = str(description).strip()
-        
-        # Security: Limit length to prevent abuse
-        if len(description) > 100:
-            raise serializers.ValidationError("Description too long (max 100 characters)")
-        
-        # Security: Remove HTML and script tags
-        description = bleach.clean(description, tags=[], attributes={}, strip=True)
-        
-        # Security: Escape HTML entities
-        description = html.escape(description)
-        
-        # Security: Only allow alphanumeric, spaces, and basic punctuation
-        if not re.match(r'^[a-zA-Z0-9\s\-_\.\,\!\?]+$', description):
-            raise serializers.ValidationError("Description contains invalid characters")
-            
-        return description
+        return _validate_text(description, "Description", _MAX_LEN_DESC, _DESC_CHARS)
 
 
 class TransactionSerializer(serializers.ModelSerializer):
@@ -195,21 +271,96 @@ class TransactionSerializer(serializers.ModelSerializer):
     # Include computed properties for convenience
     is_successful = serializers.ReadOnlyField()
     is_pending = serializers.ReadOnlyField()
-    status_display = serializers.SerializerMethodField()
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
     
     class Meta:
         model = models.Transaction
-        # Include all model fields in serialization
-        fields = "__all__"
-        
-    def get_status_display(self, obj):
+        # Listed explicitly so to_representation and Meta can't drift apart
+        fields = (
+            "id",
+            "is_successful",
+            "is_pending",
+            "status_display",
+            "transaction_no",
+            "phone_number",
+            "checkout_request_id",
+            "reference",
+            "description",
+            "amount",
+            "status",
+            "receipt_no",
+            "created",
+            "updated_at",
+            "ip",
+        )
+    
+    def to_representation(self, obj):
         """
-        Get human-readable status display.
+        Build the response dict by direct attribute access.
+        
+        Transactions are read-only in the API, so this skips DRF's per-field
+        iteration; the output matches what the declared fields produce.
         
         Args:
             obj (Transaction): Transaction model instance
             
         Returns:
-            str: Human-readable status (e.g., "Complete", "Pending")
+            dict: Serialized transaction data
         """
-        return obj.get_status_display()
\ No newline at end of file
+        status = obj.status
+        amount = obj.amount
+        created = obj.created
+        updated_at = obj.updated_at
+        return {
+            'id': obj.id,
+            'is_successful': obj.is_successful,
+            'is_pending': obj.is_pending,
+            'status_display': obj.get_status_display(),
+            'transaction_no': str(obj.transaction_no),
+            'phone_number': str(obj.phone_number),
+            'checkout_request_id': obj.checkout_request_id,
+            'reference': obj.reference,
+            'description': obj.description,
+            'amount': None if amount is None else _AMOUNT_FIELD.to_representation(amount),
+            'status': status if status in ('', None) else str(status),
+            'receipt_no': obj.receipt_no,
+            'created': None if created is None else _DATETIME_FIELD.to_representation(created),
+            'updated_at': None if updated_at is None else _DATETIME_FIELD.to_representation(updated_at),
+            'ip': obj.ip,
+        }
+    
+    @classmethod
+    def serialize_many(cls, queryset):
+        """
+        Serialize many transactions from a single values() query.
+        
+        Rows come back from the database as plain dicts, so no model
+        instances are built; the output matches to_representation.
+        
+        Args:
+            queryset (QuerySet): Transactions to serialize
+            
+        Returns:
+            list: Serialized transaction dicts, in queryset order
+        """
+        status_map = dict(models.STATUS)
+        amount_to_repr = _AMOUNT_FIELD.to_representation
+        datetime_to_repr = _DATETIME_FIELD.to_representation
+        rows = queryset.values(
+            'id', 'transaction_no', 'phone_number', 'checkout_request_id', 'reference',
+            'description', 'amount', 'status', 'receipt_no', 'created', 'updated_at', 'ip',
+        )
+        
+        results = []
+        for row in rows:
+            status = row['status']
+            row['is_successful'] = status == "0"
+            row['is_pending'] = status == "1"
+            row['status_display'] = status_map.get(status, status)
+            row['transaction_no'] = str(row['transaction_no'])
+            row['phone_number'] = str(row['phone_number'])
+            row['amount'] = amount_to_repr(row['amount'])
+            row['created'] = datetime_to_repr(row['created'])
+            row['updated_at'] = datetime_to_repr(row['updated_at'])
+            results.append(row)
+        return results
@@ -0,0 +1,61 @@
+"""
+M-Pesa Signal Handlers
+
+This module keeps cached views of transaction data in step with the
+database. It is imported from MpesaConfig.ready() so the receivers are
+connected once per process.
+
+Components:
+    - transaction_list_version: Current version stamp of the transaction list
+    - invalidate_transaction_list: post_save/post_delete receiver that bumps it
+
+Cache Invalidation:
+    The Transaction admin changelist is cached for a short window. Its cache
+    key includes the version stamp, so bumping the stamp whenever a
+    transaction is created, updated or deleted makes every cached page stale
+    at once without having to know which pages were cached. Queryset
+    update()/bulk_update() calls send no signals; callers that need the list
+    fresh (the payment callback handler) bump the stamp themselves, other
+    changes show up when the cached page expires.
+
+Author: M-Pesa Integration Team
+Date: 2024
+"""
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Transaction
+
+# Cache key holding the transaction list version stamp
+TRANSACTION_LIST_VERSION_KEY = 'mpesa:transaction_list_version'
+
+
+def transaction_list_version():
+    """
+    Get the current transaction list version stamp.
+
+    Returns:
+        int: Version stamp, changed on every transaction write
+    """
+    return cache.get(TRANSACTION_LIST_VERSION_KEY, 0)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def invalidate_transaction_list(sender, **kwargs):
+    """
+    Bump the transaction list version so cached list pages are not reused.
+
+    Args:
+        sender (type): The Transaction model class
+        **kwargs: Signal arguments (instance, created, ...), unused
+    """
+    # add() creates the key without expiry; incr() is atomic on Redis
+    if not cache.add(TRANSACTION_LIST_VERSION_KEY, 1, None):
+        try:
+            cache.incr(TRANSACTION_LIST_VERSION_KEY)
+        except ValueError:
+            # Key evicted between add() and incr(); start a new stamp
+            cache.set(TRANSACTION_LIST_VERSION_KEY, 1, None)
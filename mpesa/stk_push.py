@@ -11,26 +11,127 @@ Key Features:
 - Payment status queries
 - Callback handling from Safaricom
 - Transaction database management
+- Pooled, retrying HTTP connections to the Safaricom API
 """
 
 import logging
+import threading
 import time
 import math
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
 from rest_framework.response import Response
 from phonenumber_field.phonenumber import PhoneNumber
 
 from config.settings import env
 from .models import Transaction
-from .serializers import TransactionSerializer
-from .utils import get_client_ip
+from .signals import invalidate_transaction_list
+from .utils import get_client_ip, json_dumps, json_loads
 
 # Initialize logger for this module
 logging = logging.getLogger("default")
 
+
+def _build_session():
+    """
+    Create a requests Session for the Safaricom API.
+    
+    The OAuth, STK push and STK query endpoints share one host, so a
+    Session lets urllib3 keep the TCP+TLS connection open between calls
+    instead of handshaking for every request.
+    
+    Connection failures and 502/503/504 responses are retried twice with a
+    short backoff. urllib3 only retries reads and status codes for
+    idempotent methods, so an STK push POST that reached Safaricom is never
+    sent twice.
+    
+    Returns:
+        requests.Session: Session with a pooled, retrying HTTPS adapter
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=64,  # Enough for every worker thread to hold a connection
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+# Process-wide session, created on first use by _get_session()
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """
+    Get the Session shared by every MpesaGateWay in this process.
+    
+    The connection pool lives in the Session, so sharing it is what lets
+    separate Django requests reuse the same Safaricom connections.
+    
+    Returns:
+        requests.Session: The shared session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            # Re-check: another thread may have built it while we waited
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+# Most recent OAuth token, shared by every gateway in the process:
+# (consumer_key, token, expiry timestamp). Replaced as a whole tuple, so
+# readers never see a token paired with another token's expiry
+_cached_token = (None, None, 0.0)
+
+# Held while fetching a new token, so concurrent requests that find the
+# token expired make one OAuth call between them instead of one each
+_token_refresh_lock = threading.Lock()
+
+# Seconds a token is treated as valid (Safaricom issues 1-hour tokens)
+TOKEN_LIFETIME = 3400
+
+# Don't hand out a cached token with less than this many seconds left
+TOKEN_MIN_REMAINING = 60
+
+# Worker threads that apply payment callbacks after Safaricom has been
+# acknowledged (see MpesaGateWay.callback_handler). Threads start on first use
+_callback_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mpesa-callback")
+
+
+def _apply_callback_in_background(gateway, data):
+    """
+    Apply a payment callback on a _callback_executor thread.
+    
+    Executor threads aren't Django requests, so stale database connections
+    are released here the way request_started/request_finished would, and
+    errors are logged because nobody waits on the future.
+    
+    Args:
+        gateway (MpesaGateWay): Gateway that received the callback
+        data (dict): JSON callback data from Safaricom
+    """
+    close_old_connections()
+    try:
+        gateway.apply_callback(data)
+    except Exception:
+        logging.exception("Failed to apply M-Pesa callback")
+    finally:
+        close_old_connections()
+
+
 class MpesaGateWay:
     """
     Main M-Pesa Gateway class for handling all M-Pesa API interactions.
@@ -70,6 +171,7 @@ class MpesaGateWay:
         self.access_token_url = env("access_token_url")
         self.stk_query_url = env("mpesa_query_check_url")  # STK query endpoint
         self.headers = {}  # Initialize request headers
+        self.session = _get_session()  # Pooled connections shared by all gateways
 
         # Generate password for API authentication
         self.password = self.generate_password()
@@ -78,18 +180,47 @@ class MpesaGateWay:
         self.c2b_callback = env("c2b_callback")
         self.checkout_url = env("checkout_url")
 
+        # STK Push fields that are the same for every request from this gateway
+        self._stk_template = {
+            "BusinessShortCode": self.shortcode,      # Business number (paybill/till)
+            "TransactionType": "CustomerPayBillOnline",  # Transaction type
+            "PartyB": self.shortcode,                 # Business number (same as BusinessShortCode)
+            "CallBackURL": self.c2b_callback,         # URL for payment confirmation
+        }
+
+        # Reuse a token another gateway already fetched, if it's still fresh
+        if self._use_cached_token():
+            return
+
         try:
             # Attempt to get access token
             self.access_token = self.getAccessToken()
             if self.access_token is None:
                 raise Exception("Request for access token failed.")
         except Exception as e:
-            logging.error("Error {}".format(e))
+            logging.error("Error %s", e)
             # Set default headers even if token fails to prevent crashes
             self.headers = {"Authorization": "Bearer "}
-        else:
-            # Set token expiration time (3400 seconds = ~57 minutes, slightly less than 1 hour)
-            self.access_token_expiration = time.time() + 3400
+
+    def _use_cached_token(self):
+        """
+        Adopt the process-wide token if it belongs to these credentials and
+        has more than TOKEN_MIN_REMAINING seconds left.
+        
+        Returns:
+            bool: True if the cached token was adopted, False otherwise
+        """
+        consumer_key, token, expiration = _cached_token
+        if (
+            token
+            and consumer_key == self.consumer_key
+            and expiration - time.time() > TOKEN_MIN_REMAINING
+        ):
+            self.access_token = token
+            self.access_token_expiration = expiration
+            self.headers = {"Authorization": "Bearer %s" % token}
+            return True
+        return False
 
     def getAccessToken(self):
         """
@@ -106,9 +237,10 @@ class MpesaGateWay:
         """
         try:
             # Make OAuth request using Basic Authentication
-            res = requests.get(
+            res = self.session.get(
                 self.access_token_url,
                 auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret),
+                timeout=30,  # Other threads wait on a refresh, so don't hang forever
             )
             res.raise_for_status()  # Raise exception for HTTP error status codes
             
@@ -121,14 +253,37 @@ class MpesaGateWay:
                 
             # Set authorization header for future requests
             self.headers = {"Authorization": "Bearer %s" % token}
+            
+            # Expire slightly before Safaricom does (3400 seconds = ~57 minutes)
+            self.access_token_expiration = time.time() + TOKEN_LIFETIME
+            
+            # Share with the other gateways in this process
+            global _cached_token
+            _cached_token = (self.consumer_key, token, self.access_token_expiration)
             return token
             
         except Exception as err:
-            logging.error("Error getting access token: {}".format(err))
+            logging.error("Error getting access token: %s", err)
             # Set empty bearer token to prevent None errors
             self.headers = {"Authorization": "Bearer "}
             raise err
 
+    def _refresh_access_token(self):
+        """
+        Fetch a new access token unless another thread just did.
+        
+        Threads that find the token expired queue on _token_refresh_lock;
+        the first one fetches, the rest adopt its token once they get the
+        lock.
+        
+        Raises:
+            Exception: If the token request fails
+        """
+        with _token_refresh_lock:
+            if self._use_cached_token():
+                return
+            self.access_token = self.getAccessToken()
+
     class Decorators:
         """
         Utility decorators for the MpesaGateWay class.
@@ -153,13 +308,14 @@ class MpesaGateWay:
                 if (
                     gateway.access_token_expiration
                     and time.time() > gateway.access_token_expiration
+                    # Another gateway may have refreshed it already
+                    and not gateway._use_cached_token()
                 ):
                     try:
-                        # Refresh the access token
-                        token = gateway.getAccessToken()
-                        gateway.access_token = token
+                        # Refresh the access token (one thread at a time)
+                        gateway._refresh_access_token()
                     except Exception as e:
-                        logging.error("Failed to refresh token: {}".format(e))
+                        logging.error("Failed to refresh token: %s", e)
                         # Continue with existing token (may fail, but worth trying)
                         
                 # Execute the original method
@@ -193,7 +349,15 @@ class MpesaGateWay:
         password_bytes = password_str.encode("ascii")
         return base64.b64encode(password_bytes).decode("utf-8")
 
-    @Decorators.refreshToken
+    def _json_headers(self):
+        """
+        Build the headers for a request whose body is already JSON-encoded.
+        
+        Returns:
+            dict: Authorization headers plus the JSON Content-Type
+        """
+        return {**self.headers, "Content-Type": "application/json"}
+
     def stk_push_request(self, payload):
         """
         Initiate an STK Push payment request to customer's phone.
@@ -209,6 +373,47 @@ class MpesaGateWay:
         Returns:
             dict: M-Pesa API response containing CheckoutRequestID and status
         """
+        res_data, transaction_data = self._send_stk_push(payload)
+        if transaction_data:
+            # Save transaction to database
+            Transaction.objects.create(**transaction_data)
+            logging.info("Transaction record created successfully")
+        return res_data
+
+    async def astk_push_request(self, payload):
+        """
+        Async version of stk_push_request for use from async views.
+        
+        The blocking Safaricom call runs in a worker thread so the event loop
+        keeps serving other requests meanwhile; the transaction is saved with
+        the async ORM.
+        
+        Args:
+            payload (dict): Same as for stk_push_request
+                
+        Returns:
+            dict: M-Pesa API response containing CheckoutRequestID and status
+        """
+        res_data, transaction_data = await sync_to_async(
+            self._send_stk_push, thread_sensitive=False
+        )(payload)
+        if transaction_data:
+            await Transaction.objects.acreate(**transaction_data)
+            logging.info("Transaction record created successfully")
+        return res_data
+
+    @Decorators.refreshToken
+    def _send_stk_push(self, payload):
+        """
+        Send the STK Push request to Safaricom (no database access).
+        
+        Args:
+            payload (dict): Contains 'request' (Django request) and 'data' (validated form data)
+                
+        Returns:
+            tuple: (M-Pesa API response dict, Transaction field values to
+                save, or None if the push was not accepted)
+        """
         # Extract request and data from payload
         request = payload["request"]
         data = payload["data"]
@@ -222,30 +427,28 @@ class MpesaGateWay:
         # Generate fresh password and timestamp for this request
         fresh_password = self.generate_password()
         
-        # Prepare STK Push request data according to Safaricom API specification
+        # Fill the per-request fields into the constant STK Push template.
+        # Password and Timestamp must be fresh, so they are not part of it
         req_data = {
-            "BusinessShortCode": self.shortcode,      # Business number (paybill/till)
+            **self._stk_template,
             "Password": fresh_password,               # Base64 encoded password (fresh)
             "Timestamp": self.timestamp,              # Request timestamp (fresh)
-            "TransactionType": "CustomerPayBillOnline",  # Transaction type
             "Amount": math.ceil(float(amount)),       # Round up amount to nearest integer
             "PartyA": phone_number,                   # Customer phone number
-            "PartyB": self.shortcode,                 # Business number (same as BusinessShortCode)
             "PhoneNumber": phone_number,              # Phone number to receive STK push
-            "CallBackURL": self.c2b_callback,         # URL for payment confirmation
             "AccountReference": reference,            # Payment reference
             "TransactionDesc": description,           # Payment description
         }
 
-        # Send STK Push request to Safaricom API
-        res = requests.post(
-            self.checkout_url, json=req_data, headers=self.headers, timeout=30
+        # Send STK Push request to Safaricom API (encoded with orjson when available)
+        res = self.session.post(
+            self.checkout_url, data=json_dumps(req_data), headers=self._json_headers(), timeout=30
         )
-        res_data = res.json()
+        res_data = json_loads(res.content)
         
         # Log request and response for debugging
-        logging.info("Mpesa request data {}".format(req_data))
-        logging.info("Mpesa response info {}".format(res_data))
+        logging.info("Mpesa request data %s", req_data)
+        logging.info("Mpesa response info %s", res_data)
 
         # Check if request was successful
         if res.ok and res_data.get("ResponseCode") == "0":
@@ -259,15 +462,12 @@ class MpesaGateWay:
                 "ip": get_client_ip(request),  # Customer's real IP address
                 "status": "1"  # Set as Pending initially
             }
-            
-            # Save transaction to database
-            Transaction.objects.create(**transaction_data)
-            logging.info("Transaction record created successfully")
         else:
             # Log error if STK push failed
-            logging.error("STK push failed: {}".format(res_data))
+            logging.error("STK push failed: %s", res_data)
+            transaction_data = None
             
-        return res_data
+        return res_data, transaction_data
 
     @Decorators.refreshToken
     def stk_push_query(self, checkout_request_id):
@@ -296,24 +496,24 @@ class MpesaGateWay:
 
         try:
             # Log the request before sending
-            logging.info("STK Query request data {}".format(req_data))
-            logging.info("STK Query URL: {}".format(self.stk_query_url))
-            logging.info("Request headers: {}".format(self.headers))
+            logging.info("STK Query request data %s", req_data)
+            logging.info("STK Query URL: %s", self.stk_query_url)
+            logging.info("Request headers: %s", self.headers)
             
             # Send query request to Safaricom API
-            res = requests.post(
-                self.stk_query_url, json=req_data, headers=self.headers, timeout=30
+            res = self.session.post(
+                self.stk_query_url, data=json_dumps(req_data), headers=self._json_headers(), timeout=30
             )
             
             # Log response status
-            logging.info("STK Query response status: {}".format(res.status_code))
+            logging.info("STK Query response status: %s", res.status_code)
             
             # Check if response is valid JSON
             try:
-                res_data = res.json()
+                res_data = json_loads(res.content)
             except ValueError as json_error:
-                logging.error("Invalid JSON response: {}".format(json_error))
-                logging.error("Response text: {}".format(res.text))
+                logging.error("Invalid JSON response: %s", json_error)
+                logging.error("Response text: %s", res.text)
                 return {
                     "ResultCode": "1", 
                     "ResultDesc": "Invalid response format", 
@@ -321,11 +521,11 @@ class MpesaGateWay:
                 }
             
             # Log query response
-            logging.info("STK Query response info {}".format(res_data))
+            logging.info("STK Query response info %s", res_data)
             
             # Check for HTTP errors
             if not res.ok:
-                logging.error("HTTP error {}: {}".format(res.status_code, res_data))
+                logging.error("HTTP error %s: %s", res.status_code, res_data)
                 return {
                     "ResultCode": "1", 
                     "ResultDesc": "HTTP error {}".format(res.status_code), 
@@ -335,15 +535,30 @@ class MpesaGateWay:
             return res_data
             
         except requests.exceptions.Timeout as timeout_error:
-            logging.error("STK Query timeout: {}".format(timeout_error))
+            logging.error("STK Query timeout: %s", timeout_error)
             return {"ResultCode": "1", "ResultDesc": "Request timeout", "error": str(timeout_error)}
         except requests.exceptions.ConnectionError as conn_error:
-            logging.error("STK Query connection error: {}".format(conn_error))
+            logging.error("STK Query connection error: %s", conn_error)
             return {"ResultCode": "1", "ResultDesc": "Connection error", "error": str(conn_error)}
         except Exception as e:
-            logging.error("STK Query error: {}".format(e))
+            logging.error("STK Query error: %s", e)
             return {"ResultCode": "1", "ResultDesc": "Query failed", "error": str(e)}
 
+    async def astk_push_query(self, checkout_request_id):
+        """
+        Async version of stk_push_query for use from async views.
+        
+        The query makes no database writes, so the whole blocking call runs
+        in a worker thread, off the event loop.
+        
+        Args:
+            checkout_request_id (str): Unique identifier from STK push response
+            
+        Returns:
+            dict: M-Pesa API response with transaction status information
+        """
+        return await sync_to_async(self.stk_push_query, thread_sensitive=False)(checkout_request_id)
+
     def check_status(self, data):
         """
         Extract status code from M-Pesa callback data.
@@ -358,7 +573,7 @@ class MpesaGateWay:
             # Navigate through callback data structure to get status
             status = str(data["Body"]["stkCallback"]["ResultCode"])
         except Exception as e:
-            logging.error(f"Error extracting status: {e}")
+            logging.error("Error extracting status: %s", e)
             status = "1"  # Default to failed/pending if structure is unexpected
         return status
 
@@ -385,173 +600,201 @@ class MpesaGateWay:
     def handle_successful_pay(self, data, transaction):
         """
         Process successful payment callback and update transaction record.
-        
+
         Extracts payment details from Safaricom callback and updates the
         transaction record with receipt number and confirmation details.
-        
+
         Args:
             data (dict): Callback data from Safaricom containing payment details
             transaction (Transaction): Database transaction object to update
-            
+
         Returns:
             Transaction: Updated transaction object
         """
+        fields = self.successful_pay_fields(data, transaction.checkout_request_id)
+        for name, value in fields.items():
+            setattr(transaction, name, value)
+        return transaction
+
+    def successful_pay_fields(self, data, checkout_request_id):
+        """
+        Extract the transaction fields to update from a successful payment callback.
+
+        Args:
+            data (dict): Callback data from Safaricom containing payment details
+            checkout_request_id (str): CheckoutRequestID of the transaction
+
+        Returns:
+            dict: Model field names mapped to their new values
+        """
         # Log the full callback data structure for debugging
         logging.info("Processing successful payment callback")
-        logging.info("Callback data structure: {}".format(str(data)[:500]))  # Truncate to avoid log spam
-        
+        logging.info("Callback data structure: %.500s", data)  # Truncate to avoid log spam
+
+        # Mark transaction as complete ("0" = Complete status)
+        fields = {"status": "0"}
+
         # Extract callback metadata containing payment details
         try:
             items = data["Body"]["stkCallback"]["CallbackMetadata"]["Item"]
-            logging.info("Found {} callback items to process".format(len(items)))
+            logging.info("Found %s callback items to process", len(items))
         except KeyError as e:
-            logging.error("Missing callback metadata structure: {}".format(e))
-            
+            logging.error("Missing callback metadata structure: %s", e)
+
             # If callback metadata is missing, try to query M-Pesa for transaction details
             logging.info("Attempting to query M-Pesa for transaction details as fallback")
-            try:
-                query_result = self.stk_push_query(transaction.checkout_request_id)
-                
-                # If query successful and contains receipt info, use it
-                if (query_result and 
-                    isinstance(query_result, dict) and 
-                    query_result.get('ResultCode') == '0' and
-                    'local_transaction' in query_result and
-                    query_result['local_transaction'].get('receipt_no')):
-                    
-                    receipt_no = query_result['local_transaction']['receipt_no']
-                    transaction.receipt_no = receipt_no
-                    logging.info("Retrieved receipt number from query: {}".format(receipt_no))
-                else:
-                    logging.warning("Could not retrieve receipt number from query")
-                    
-            except Exception as query_error:
-                logging.error("Failed to query M-Pesa for transaction details: {}".format(query_error))
-            
-            # Mark as complete even without full callback data
-            transaction.status = "0"
-            return transaction
-        
-        # Initialize variables for payment details
-        amount = None
-        receipt_no = None
-        phone_number = None
-        transaction_date = None
-        
-        # Parse callback items to extract payment information
-        for item in items:
-            item_name = item.get("Name", "Unknown")
-            item_value = item.get("Value", "None")
-            logging.info("Processing callback item: {} = {}".format(item_name, item_value))
-            
-            if item_name == "Amount":
-                amount = item_value
-            elif item_name == "MpesaReceiptNumber":
-                receipt_no = item_value  # M-Pesa transaction receipt
-                logging.info("Found receipt number: {}".format(receipt_no))
-            elif item_name == "PhoneNumber":
-                phone_number = item_value
-            elif item_name == "TransactionDate":
-                transaction_date = item_value
-
-        # Update transaction with callback data
+            receipt_no = self._query_receipt_no(checkout_request_id)
+            if receipt_no:
+                fields["receipt_no"] = receipt_no
+            else:
+                logging.warning("Could not retrieve receipt number from query")
+
+            # Complete even without full callback data
+            return fields
+
+        # Index callback items by name: one pass, then a hash lookup per field
+        kv = {it.get("Name"): it.get("Value") for it in items}
+        logging.info("Callback items: %s", kv)
+
+        amount = kv.get("Amount")
+        receipt_no = kv.get("MpesaReceiptNumber")  # M-Pesa transaction receipt
+        phone_number = kv.get("PhoneNumber")
+
+        # Collect the callback data to store on the transaction
         if amount:
-            transaction.amount = str(amount)
-            logging.info("Updated amount: {}".format(amount))
+            fields["amount"] = str(amount)
+            logging.info("Updated amount: %s", amount)
         if phone_number:
-            # Convert phone number to PhoneNumber object
-            transaction.phone_number = PhoneNumber(raw_input=str(phone_number))
-            logging.info("Updated phone number: {}".format(phone_number))
-        if receipt_no:
-            transaction.receipt_no = receipt_no  # Store M-Pesa receipt number
-            logging.info("Updated receipt number: {}".format(receipt_no))
-        else:
-            logging.warning("No receipt number found in callback data for transaction {}".format(transaction.transaction_no))
-            
+            # Wrap the number in a PhoneNumber. raw_input only stores the string
+            # (nothing is parsed, here or on save), so there is no parse to cache;
+            # passing the bare string instead would make the field parse it
+            fields["phone_number"] = PhoneNumber(raw_input=str(phone_number))
+            logging.info("Updated phone number: %s", phone_number)
+        if not receipt_no:
+            logging.warning("No receipt number found in callback data for %s", checkout_request_id)
+
             # Try to query M-Pesa as a fallback
             logging.info("Attempting to retrieve receipt number via STK query")
-            try:
-                query_result = self.stk_push_query(transaction.checkout_request_id)
-                
-                if (query_result and 
-                    isinstance(query_result, dict) and 
-                    query_result.get('ResultCode') == '0' and
-                    'local_transaction' in query_result and
-                    query_result['local_transaction'].get('receipt_no')):
-                    
-                    receipt_no = query_result['local_transaction']['receipt_no']
-                    transaction.receipt_no = receipt_no
-                    logging.info("Successfully retrieved receipt number from query: {}".format(receipt_no))
-                    
-            except Exception as query_error:
-                logging.error("Failed to query receipt number: {}".format(query_error))
-            
-        # Mark transaction as complete
-        transaction.status = "0"  # "0" = Complete status
-        logging.info("Transaction {} marked as complete".format(transaction.transaction_no))
-        
-        return transaction
+            receipt_no = self._query_receipt_no(checkout_request_id)
+        if receipt_no:
+            fields["receipt_no"] = receipt_no  # Store M-Pesa receipt number
+            logging.info("Updated receipt number: %s", receipt_no)
+
+        return fields
+
+    def _query_receipt_no(self, checkout_request_id):
+        """
+        Ask M-Pesa for the receipt number of a transaction.
+
+        Args:
+            checkout_request_id (str): CheckoutRequestID of the transaction
+
+        Returns:
+            str: Receipt number, or None if the query did not return one
+        """
+        try:
+            query_result = self.stk_push_query(checkout_request_id)
+        except Exception as query_error:
+            logging.error("Failed to query receipt number: %s", query_error)
+            return None
+
+        # Only a successful query carrying receipt info is usable
+        if (query_result and
+            isinstance(query_result, dict) and
+            query_result.get('ResultCode') == '0' and
+            'local_transaction' in query_result and
+            query_result['local_transaction'].get('receipt_no')):
+
+            receipt_no = query_result['local_transaction']['receipt_no']
+            logging.info("Retrieved receipt number from query: %s", receipt_no)
+            return receipt_no
+        return None
 
     def callback_handler(self, data):
         """
         Main callback handler for processing M-Pesa payment confirmations.
-        
+
         This method is called when Safaricom sends payment status updates.
-        It processes the callback data and updates transaction records accordingly.
-        
+        By default the transaction is updated before the acknowledgement is
+        returned. With MPESA_ASYNC_CALLBACKS = True the update (and any
+        fallback STK query) runs on a background thread and Safaricom is
+        acknowledged at once; an update still queued when the process stops
+        is lost, leaving the transaction pending until it is checked with an
+        STK query, since Safaricom doesn't resend acknowledged callbacks.
+
         Args:
             data (dict): JSON callback data from Safaricom
-            
+
         Returns:
             Response: HTTP response to acknowledge callback receipt
+
+        Raises:
+            ValueError: If the callback has no CheckoutRequestID
         """
         # Log callback receipt for debugging
         logging.info("Received M-Pesa callback")
-        logging.info("Callback data keys: {}".format(list(data.keys())))
+        logging.info("Callback data keys: %s", list(data.keys()))
+
+        # Reject malformed callbacks here, while the caller can still see the error
+        if "CheckoutRequestID" not in data.get("Body", {}).get("stkCallback", {}):
+            raise ValueError("M-Pesa callback has no Body.stkCallback.CheckoutRequestID")
+
+        if getattr(settings, "MPESA_ASYNC_CALLBACKS", False):
+            _callback_executor.submit(_apply_callback_in_background, self, data)
+        else:
+            self.apply_callback(data)
+
+        # Return success response to Safaricom (required to acknowledge callback)
+        return Response({"status": "ok", "code": 0}, status=200)
+
+    def apply_callback(self, data):
+        """
+        Update the transaction record from a payment callback.
         
+        The transaction row is changed with a single UPDATE; a row is only
+        created when the callback refers to an unknown CheckoutRequestID.
+
+        Args:
+            data (dict): JSON callback data from Safaricom
+        """
         # Extract status from callback data
         status = self.check_status(data)
-        logging.info("Callback status determined: {}".format(status))
-        
-        # Get the associated transaction record
-        transaction = self.get_transaction_object(data)
-        if transaction:
-            logging.info("Found transaction: {} for callback".format(transaction.transaction_no))
-        else:
-            logging.error("No transaction found for callback data")
-        
+        logging.info("Callback status determined: %s", status)
+
+        checkout_request_id = data["Body"]["stkCallback"]["CheckoutRequestID"]
+
         if status == "0":
             # Payment was successful - process confirmation
             logging.info("Processing successful payment callback")
-            self.handle_successful_pay(data, transaction)
-            logging.info("Payment successful for CheckoutRequestID: {}".format(
-                data["Body"]["stkCallback"]["CheckoutRequestID"]
-            ))
+            fields = self.successful_pay_fields(data, checkout_request_id)
+            logging.info("Payment successful for CheckoutRequestID: %s", checkout_request_id)
         else:
             # Map different failure codes to appropriate statuses
             result_code = str(data.get("Body", {}).get("stkCallback", {}).get("ResultCode", "1"))
-            logging.info("Processing failed payment with ResultCode: {}".format(result_code))
-            
+            logging.info("Processing failed payment with ResultCode: %s", result_code)
+
             if result_code == "1032":  # User cancelled
-                transaction.status = "3"  # Cancelled
+                fields = {"status": "3"}  # Cancelled
             elif result_code == "1037":  # Timeout
-                transaction.status = "4"  # Timeout
+                fields = {"status": "4"}  # Timeout
             elif result_code in ["1", "17"]:   # Insufficient funds or other payment failures
-                transaction.status = "2"  # Failed
+                fields = {"status": "2"}  # Failed
             else:
-                transaction.status = "2"  # General failure
-                
-            logging.warning("Payment failed for CheckoutRequestID: {} with status: {} (ResultCode: {})".format(
-                data["Body"]["stkCallback"]["CheckoutRequestID"], transaction.status, result_code
-            ))
-
-        # Save the updated transaction to database
-        transaction.save()
-        logging.info("Transaction {} saved to database".format(transaction.transaction_no))
+                fields = {"status": "2"}  # General failure
 
-        # Serialize transaction data for logging
-        transaction_data = TransactionSerializer(transaction).data
-        logging.info("Transaction completed info {}".format(transaction_data))
+            logging.warning(
+                "Payment failed for CheckoutRequestID: %s with status: %s (ResultCode: %s)",
+                checkout_request_id, fields["status"], result_code
+            )
 
-        # Return success response to Safaricom (required to acknowledge callback)
-        return Response({"status": "ok", "code": 0}, status=200)
\ No newline at end of file
+        # Update the transaction in one statement (should already exist from STK push).
+        # update() skips auto_now, so the modification time is set explicitly.
+        fields["updated_at"] = timezone.now()
+        updated = Transaction.objects.filter(checkout_request_id=checkout_request_id).update(**fields)
+        if updated:
+            # update() sends no post_save, so refresh cached transaction lists here
+            invalidate_transaction_list(Transaction)
+        else:
+            logging.error("No transaction found for callback data, creating one")
+            Transaction.objects.get_or_create(checkout_request_id=checkout_request_id, defaults=fields)
+        logging.info("Transaction %s updated in database: %s", checkout_request_id, fields)
\ No newline at end of file
@@ -1,20 +1,29 @@
 import json
 import uuid
+import threading
+import time
 from unittest.mock import patch, Mock, MagicMock
 from decimal import Decimal
 
-from django.test import TestCase, Client
+from asgiref.sync import async_to_sync
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from rest_framework.test import APITestCase, APIClient
-from rest_framework import status
+from rest_framework import serializers, status
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
 from phonenumber_field.phonenumber import PhoneNumber
 
 from .models import Transaction
 from .serializers import MpesaCheckoutSerializer, TransactionSerializer
-from .stk_push import MpesaGateWay
+from .stk_push import MpesaGateWay, _apply_callback_in_background
 from .phone_number_validation import validate_possible_number
 from .views import SafaricomIPWhitelist
+from .callback_security import (
+    CallbackStructureValidator, EnhancedCallbackSecurity, HMACSignatureValidator
+)
 
 
 class TransactionModelTest(TestCase):
@@ -93,6 +102,22 @@ class PhoneNumberValidationTest(TestCase):
             with self.assertRaises(Exception):
                 validate_possible_number(number, 'KE')
 
+    def test_repeat_numbers_use_cache(self):
+        """Test repeat validations of a string hit the cache, invalid ones included"""
+        from .phone_number_validation import _parse_valid_number
+
+        _parse_valid_number.cache_clear()
+        first = validate_possible_number('254718643064', 'KE')
+        self.assertIs(validate_possible_number('254718643064', 'KE'), first)
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                validate_possible_number('123456789', 'KE')
+        self.assertEqual(_parse_valid_number.cache_info().hits, 2)
+
+        # PhoneNumber objects are validated without touching the cache
+        self.assertEqual(validate_possible_number(first, 'KE'), first)
+        self.assertEqual(_parse_valid_number.cache_info().currsize, 2)
+
 
 class MpesaCheckoutSerializerTest(TestCase):
     """Test cases for MpesaCheckoutSerializer"""
@@ -120,6 +145,9 @@ class MpesaCheckoutSerializerTest(TestCase):
             ('0718643064', '254718643064'),
             ('+254718643064', '254718643064'),
             ('254718643064', '254718643064'),
+            ('0718 643-064', '254718643064'),
+            ('+254 (718) 643064', '254718643064'),
+            ('718643064', '254718643064'),
         ]
         
         for input_number, expected_output in test_cases:
@@ -141,6 +169,46 @@ class MpesaCheckoutSerializerTest(TestCase):
         serializer = MpesaCheckoutSerializer(data=invalid_data)
         self.assertFalse(serializer.is_valid())
         self.assertIn('phone_number', serializer.errors)
+        
+        # A trunk 0 in front of the full international number is not valid
+        serializer = MpesaCheckoutSerializer(data={'phone_number': '0254718643064', 'amount': '100'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('phone_number', serializer.errors)
+    
+    def test_canonical_phone_number_still_validated(self):
+        """Test that the canonical-form fast path still rejects invalid numbers"""
+        serializer = MpesaCheckoutSerializer(data={'phone_number': '254000000000', 'amount': '100'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('phone_number', serializer.errors)
+    
+    def test_text_fields_sanitized(self):
+        """Test that plain text passes unchanged and markup is stripped"""
+        data = {
+            'phone_number': '0718643064',
+            'amount': '100',
+            'reference': 'ORDER-12345',
+            'description': '<b>Monthly</b> fee',
+        }
+        serializer = MpesaCheckoutSerializer(data=data)
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['reference'], 'ORDER-12345')
+        self.assertEqual(serializer.validated_data['description'], 'Monthly fee')
+    
+    def test_invalid_text_characters(self):
+        """Test that non-ASCII input and markup-only text are rejected"""
+        invalid_fields = [
+            ('phone_number', '\u0660718643064'),  # Arabic-Indic zero
+            ('reference', 'ORDER\u00a0123'),     # No-break space
+            ('reference', '<b></b>'),             # Empty once tags are stripped
+            ('reference', 'A & B Ltd'),
+            ('description', 'Caf\u00e9 order'),
+        ]
+        
+        for field, value in invalid_fields:
+            data = {'phone_number': '0718643064', 'amount': '100', field: value}
+            serializer = MpesaCheckoutSerializer(data=data)
+            self.assertFalse(serializer.is_valid())
+            self.assertIn(field, serializer.errors)
     
     def test_invalid_amount(self):
         """Test serializer with invalid amount"""
@@ -155,6 +223,19 @@ class MpesaCheckoutSerializerTest(TestCase):
             self.assertFalse(serializer.is_valid())
             self.assertIn('amount', serializer.errors)
     
+    def test_amount_range_error(self):
+        """Test that out-of-range amounts report the allowed range"""
+        for amount in ['0.50', '300000.01']:
+            serializer = MpesaCheckoutSerializer(data={'phone_number': '0718643064', 'amount': amount})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(str(serializer.errors['amount'][0]), "Amount out of range (1 - 300000 KES)")
+    
+    def test_amount_decimal_places(self):
+        """Test that sub-cent amounts are rejected"""
+        serializer = MpesaCheckoutSerializer(data={'phone_number': '0718643064', 'amount': '10.005'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('amount', serializer.errors)
+    
     def test_default_values(self):
         """Test serializer default values"""
         minimal_data = {
@@ -190,11 +271,35 @@ class TransactionSerializerTest(TestCase):
         data = serializer.data
         
         self.assertEqual(data['phone_number'], '+254718643064')
-        self.assertEqual(data['amount'], '100')
+        self.assertEqual(data['amount'], '100.00')  # DecimalField, 2 places
         self.assertEqual(data['reference'], 'TEST-001')
         self.assertEqual(data['status'], '1')  # String, not int
+        self.assertEqual(data['status_display'], 'Pending')
         self.assertIn('transaction_no', data)
         self.assertIn('created', data)
+    
+    def test_fast_representation_matches_declared_fields(self):
+        """Test that the hand-written to_representation matches DRF's field output"""
+        self.transaction.refresh_from_db()
+        serializer = TransactionSerializer(self.transaction)
+        expected = serializers.ModelSerializer.to_representation(serializer, self.transaction)
+        self.assertEqual(serializer.data, expected)
+    
+    def test_serialize_many_matches_single_serialization(self):
+        """Test that batch serialization matches per-object output in one query"""
+        Transaction.objects.create(
+            phone_number='+254718643065',
+            amount='250.50',
+            checkout_request_id='ws_CO_test456',
+            status='0',
+            receipt_no='ABC123'
+        )
+        queryset = Transaction.objects.order_by('id')
+        
+        with self.assertNumQueries(1):
+            batch = TransactionSerializer.serialize_many(queryset)
+        
+        self.assertEqual(batch, TransactionSerializer(queryset, many=True).data)
 
 
 class SafaricomIPWhitelistTest(TestCase):
@@ -223,21 +328,432 @@ class SafaricomIPWhitelistTest(TestCase):
     
     def test_forwarded_ip(self):
         """Test request with X-Forwarded-For header"""
-        # Mock forwarded IP
+        # Mock forwarded IP, relayed by a proxy in ALLOWED_PROXY_IPS
         self.mock_request.META = {
             'HTTP_X_FORWARDED_FOR': '196.201.214.206, 10.0.0.1',
-            'REMOTE_ADDR': '10.0.0.1'
+            'REMOTE_ADDR': '127.0.0.1'
         }
         
         result = self.permission.has_permission(self.mock_request, self.mock_view)
         self.assertTrue(result)
+        
+        # The same header from a peer that isn't a trusted proxy is ignored
+        request = Mock()
+        request.META = {'HTTP_X_FORWARDED_FOR': '196.201.214.206', 'REMOTE_ADDR': '10.0.0.1'}
+        self.assertFalse(self.permission.has_permission(request, self.mock_view))
+    
+    def test_permission_decided_once_per_request(self):
+        """Test repeated checks on one request don't re-count the rate limit"""
+        self.mock_request.META = {'REMOTE_ADDR': '196.201.214.200'}
+        with patch.object(SafaricomIPWhitelist, '_check_rate_limit', return_value=True) as mock_rate_limit:
+            self.assertTrue(self.permission.has_permission(self.mock_request, self.mock_view))
+            self.assertTrue(SafaricomIPWhitelist().has_permission(self.mock_request, self.mock_view))
+        mock_rate_limit.assert_called_once()
+    
+    def test_authorized_ip_ranges(self):
+        """Test exact IPs, CIDR ranges and malformed addresses"""
+        self.assertTrue(self.permission._is_authorized_ip('196.201.212.69'))
+        self.assertTrue(self.permission._is_authorized_ip('196.201.213.5'))
+        self.assertFalse(self.permission._is_authorized_ip('196.201.215.1'))
+        self.assertFalse(self.permission._is_authorized_ip('not-an-ip'))
+
+    def test_unauthorized_warnings_rate_limited(self):
+        """Test repeated rejections from one IP log a bounded number of warnings"""
+        from django.core.cache import cache
+        from .callback_security import _unauthorized_warning_bucket
+
+        cache.clear()
+        _unauthorized_warning_bucket.cache_clear()
+        with self.assertLogs('mpesa.security', level='WARNING') as logs:
+            for _ in range(25):
+                request = Mock()
+                request.META = {'REMOTE_ADDR': '41.90.1.1'}
+                self.assertFalse(self.permission.has_permission(request, self.mock_view))
+        warnings = [line for line in logs.output if 'Unauthorized M-Pesa callback attempt' in line]
+        self.assertEqual(len(warnings), 20)
+
+    def test_ranges_grouped_by_prefix_length(self):
+        """Test ranges of the same length share one lookup and mixed lengths still match"""
+        from .callback_security import _group_ranges_by_mask
+
+        with patch.object(
+            SafaricomIPWhitelist, '_IP_RANGES_BY_MASK',
+            _group_ranges_by_mask(['10.1.0.0/16', '10.2.0.0/16', '41.90.64.0/20'])
+        ):
+            self.assertEqual(len(SafaricomIPWhitelist._IP_RANGES_BY_MASK), 2)
+            self.assertTrue(self.permission._is_authorized_ip('10.2.3.4'))
+            self.assertTrue(self.permission._is_authorized_ip('41.90.79.255'))
+            self.assertFalse(self.permission._is_authorized_ip('41.90.80.0'))
+    
+    def test_client_ip_cached_on_request(self):
+        """Test that the header scan runs once per request"""
+        self.mock_request.META = {
+            'HTTP_X_FORWARDED_FOR': '196.201.214.206, 10.0.0.1', 'REMOTE_ADDR': '127.0.0.1',
+        }
+        self.assertEqual(self.permission.get_client_ip(self.mock_request), '196.201.214.206')
+        
+        # A second call (e.g. from the security context) reads the stored value
+        self.mock_request.META = {}
+        self.assertEqual(SafaricomIPWhitelist().get_client_ip(self.mock_request), '196.201.214.206')
+    
+    def test_rate_limit(self):
+        """Test that the 101st callback in a minute from one IP is rejected"""
+        from django.core.cache import cache
+        cache.clear()
+        
+        results = [self.permission._check_rate_limit('196.201.214.200') for _ in range(101)]
+        self.assertTrue(all(results[:100]))
+        self.assertFalse(results[100])
+        cache.clear()
+    
+    @patch('mpesa.callback_security.time')
+    def test_rate_limit_sliding_window(self, mock_time):
+        """Test that earlier buckets in the window count towards the limit"""
+        from django.core.cache import cache
+        cache.clear()
+        
+        # 60 requests just before a minute boundary, 40 just after: the limit is hit
+        mock_time.time.return_value = 1_700_000_039
+        for _ in range(60):
+            self.permission._check_rate_limit('196.201.214.200')
+        mock_time.time.return_value = 1_700_000_041
+        results = [self.permission._check_rate_limit('196.201.214.200') for _ in range(41)]
+        self.assertTrue(all(results[:40]))
+        self.assertFalse(results[40])
+        
+        # Once the first burst leaves the window, requests are allowed again
+        mock_time.time.return_value = 1_700_000_039 + 60
+        self.assertTrue(self.permission._check_rate_limit('196.201.214.200'))
+        cache.clear()
+    
+    def test_security_event_timestamp_formatting(self):
+        """Test the float context timestamp is logged as ISO 8601"""
+        from datetime import datetime
+        context = {'ip': '196.201.214.200', 'method': 'POST', 'path': '/payments/callback/',
+                   'timestamp': 1_700_000_000.0}
+        with self.assertLogs('mpesa.security', level='WARNING') as logs:
+            self.permission.log_security_event('RATE_LIMIT_EXCEEDED', context)
+        self.assertEqual(logs.records[0].timestamp, datetime.fromtimestamp(1_700_000_000.0).isoformat())
+    
+    def test_security_event_headers_built_lazily(self):
+        """Test headers are only collected when DEBUG logging is enabled"""
+        get_headers = Mock(return_value={'HTTP_USER_AGENT': 'test'})
+        context = {'ip': '196.201.214.200', 'timestamp': 1_700_000_000.0, 'get_headers': get_headers}
+        
+        with self.assertLogs('mpesa.security', level='WARNING'):
+            self.permission.log_security_event('RATE_LIMIT_EXCEEDED', context)
+        get_headers.assert_not_called()
+        
+        with self.assertLogs('mpesa.security', level='DEBUG') as logs:
+            self.permission.log_security_event('RATE_LIMIT_EXCEEDED', context)
+        get_headers.assert_called_once()
+        self.assertEqual(logs.records[-1].headers, {'HTTP_USER_AGENT': 'test'})
+    
+    def test_trusted_ip_header(self):
+        """Test MPESA_TRUSTED_IP_HEADER is used when a trusted proxy sent it"""
+        self.mock_request.META = {
+            'HTTP_X_FORWARDED_FOR': '203.0.113.9',
+            'HTTP_CF_CONNECTING_IP': '196.201.214.200',
+            'REMOTE_ADDR': '127.0.0.1',
+        }
+        with self.settings(MPESA_TRUSTED_IP_HEADER='HTTP_CF_CONNECTING_IP'):
+            self.assertEqual(self.permission.get_client_ip(self.mock_request), '196.201.214.200')
+        
+        # Without the header, the normal scan applies
+        request = Mock()
+        request.META = {'HTTP_X_FORWARDED_FOR': '196.201.214.206', 'REMOTE_ADDR': '127.0.0.1'}
+        with self.settings(MPESA_TRUSTED_IP_HEADER='HTTP_CF_CONNECTING_IP'):
+            self.assertEqual(self.permission.get_client_ip(request), '196.201.214.206')
+        
+        # Spoofed by a client connecting directly, or not an IP: the header is ignored
+        for meta in (
+            {'HTTP_CF_CONNECTING_IP': '196.201.214.200', 'REMOTE_ADDR': '203.0.113.9'},
+            {'HTTP_CF_CONNECTING_IP': 'x' * 300, 'REMOTE_ADDR': '127.0.0.1'},
+            {'HTTP_CF_CONNECTING_IP': '10.0.0.1', 'REMOTE_ADDR': '127.0.0.1'},
+        ):
+            request = Mock()
+            request.META = meta
+            with self.settings(MPESA_TRUSTED_IP_HEADER='HTTP_CF_CONNECTING_IP'):
+                self.assertEqual(self.permission.get_client_ip(request), meta['REMOTE_ADDR'])
+    
+    def test_public_ip_validation(self):
+        """Test public/private classification used when scanning proxy headers"""
+        self.assertTrue(self.permission._is_valid_public_ip('196.201.214.200'))
+        self.assertTrue(self.permission._is_valid_public_ip('2001:4860::1'))
+        self.assertFalse(self.permission._is_valid_public_ip('10.0.0.1'))
+        self.assertFalse(self.permission._is_valid_public_ip('172.20.1.1'))
+        self.assertFalse(self.permission._is_valid_public_ip('224.0.0.1'))
+        self.assertFalse(self.permission._is_valid_public_ip('fe80::1'))
+        self.assertFalse(self.permission._is_valid_public_ip('1.2.3'))
 
 
+class CallbackStructureValidatorTest(TestCase):
+    """Test cases for callback payload structure validation"""
+    
+    def setUp(self):
+        self.validator = CallbackStructureValidator()
+        self.callback_data = {
+            'Body': {
+                'stkCallback': {
+                    'MerchantRequestID': '29115-34620561-1',
+                    'CheckoutRequestID': 'ws_CO_191220191020363925',
+                    'ResultCode': 0,
+                    'ResultDesc': '  The service request is processed successfully.  ',
+                    'CallbackMetadata': {
+                        'Item': [
+                            {'Name': 'Amount', 'Value': 100.00},
+                            {'Name': 'MpesaReceiptNumber', 'Value': ' NLJ7RT61SV '},
+                        ]
+                    }
+                }
+            }
+        }
+    
+    def test_valid_structure(self):
+        """Test a well-formed STK callback passes validation"""
+        result = self.validator.validate_structure(self.callback_data)
+        self.assertTrue(result['valid'])
+    
+    def test_missing_required_field(self):
+        """Test a callback without CheckoutRequestID is rejected"""
+        del self.callback_data['Body']['stkCallback']['CheckoutRequestID']
+        result = self.validator.validate_structure(self.callback_data)
+        self.assertFalse(result['valid'])
+        self.assertIn('Missing required field: Body.stkCallback.CheckoutRequestID', result['details'])
+
+    def test_missing_parent_reports_only_parent(self):
+        """Test nested fields aren't checked (or reported) when their parent is missing"""
+        del self.callback_data['Body']['stkCallback']
+        result = self.validator.validate_structure(self.callback_data)
+        self.assertFalse(result['valid'])
+        self.assertEqual(result['details'], ['Missing required field: Body.stkCallback'])
+
+    def test_shared_validator_keeps_results_separate(self):
+        """Test a reused validator doesn't mix errors between calls"""
+        first = self.validator.validate_structure({'Body': {}})
+        second = self.validator.validate_structure({})
+        self.assertEqual(first['details'], ['Missing required field: Body.stkCallback'])
+        self.assertEqual(second['details'], ['Missing required field: Body'])
+
+    def test_invalid_field_type_and_length(self):
+        """Test type and max_length rules report the full field path"""
+        self.callback_data['Body']['stkCallback']['ResultCode'] = '0'
+        self.callback_data['Body']['stkCallback']['MerchantRequestID'] = 'M' * 51
+        result = self.validator.validate_structure(self.callback_data)
+        self.assertFalse(result['valid'])
+        self.assertIn('Invalid type for Body.stkCallback.ResultCode: expected int, got str', result['details'])
+        self.assertIn('Field Body.stkCallback.MerchantRequestID exceeds maximum length of 50', result['details'])
+    
+    def test_sanitize_data_returns_trimmed_copy(self):
+        """Test sanitized strings are trimmed without modifying the original"""
+        sanitized = self.validator.sanitize_data(self.callback_data)
+        stk_callback = sanitized['Body']['stkCallback']
+        self.assertEqual(stk_callback['ResultDesc'], 'The service request is processed successfully.')
+        self.assertEqual(stk_callback['CallbackMetadata']['Item'][1]['Value'], 'NLJ7RT61SV')
+        self.assertEqual(stk_callback['CallbackMetadata']['Item'][0]['Value'], 100.00)
+        # Original payload is untouched
+        self.assertEqual(
+            self.callback_data['Body']['stkCallback']['CallbackMetadata']['Item'][1]['Value'],
+            ' NLJ7RT61SV '
+        )
+
+
+class HMACSignatureValidatorTest(TestCase):
+    """Test cases for callback HMAC signature validation"""
+    
+    def setUp(self):
+        from django.test import RequestFactory
+        self.factory = RequestFactory()
+        self.validator = HMACSignatureValidator(secret_key='test-secret')
+        self.body = json.dumps({'Body': {'stkCallback': {'ResultCode': 0}}}).encode()
+    
+    def test_generate_signature_matches_reference(self):
+        """Test the signature is base64(HMAC-SHA256(key, payload + timestamp))"""
+        import base64
+        import hashlib
+        import hmac
+        expected = base64.b64encode(
+            hmac.new(b'test-secret', self.body + b'1700000000', hashlib.sha256).digest()
+        ).decode()
+        self.assertEqual(self.validator.generate_signature(self.body, '1700000000'), expected)
+        self.assertNotEqual(self.validator.generate_signature(self.body), expected)
+    
+    @patch('mpesa.callback_security.time')
+    def test_timestamp_validation(self, mock_time):
+        """Test Unix and ISO 8601 timestamps against the 5 minute tolerance"""
+        mock_time.time.return_value = 1_700_000_000.0
+        self.assertTrue(self.validator.is_timestamp_valid('1700000100'))
+        self.assertTrue(self.validator.is_timestamp_valid('1699999800.5'))
+        self.assertFalse(self.validator.is_timestamp_valid('1700000301'))
+        # 1700000000 is 2023-11-14T22:13:20Z
+        self.assertTrue(self.validator.is_timestamp_valid('2023-11-14T22:15:00Z'))
+        self.assertTrue(self.validator.is_timestamp_valid('2023-11-15T01:13:20+03:00'))
+        self.assertFalse(self.validator.is_timestamp_valid('2023-11-14T22:30:00Z'))
+        self.assertFalse(self.validator.is_timestamp_valid('not-a-timestamp'))
+    
+    def test_validate_signature(self):
+        """Test valid, tampered and missing signatures"""
+        signature = self.validator.generate_signature(self.body)
+        request = self.factory.post(
+            '/payments/callback/', self.body, content_type='application/json',
+            HTTP_X_MPESA_SIGNATURE=signature
+        )
+        self.assertTrue(self.validator.validate_signature(request)['valid'])
+        
+        request = self.factory.post(
+            '/payments/callback/', self.body + b' ', content_type='application/json',
+            HTTP_X_MPESA_SIGNATURE=signature
+        )
+        self.assertEqual(self.validator.validate_signature(request)['error'], 'Signature mismatch')
+        
+        request = self.factory.post('/payments/callback/', self.body, content_type='application/json')
+        self.assertEqual(self.validator.validate_signature(request)['error'], 'Missing signature header')
+        
+        request = self.factory.post(
+            '/payments/callback/', self.body, content_type='application/json',
+            HTTP_X_MPESA_SIGNATURE='not base64!'
+        )
+        self.assertEqual(self.validator.validate_signature(request)['error'], 'Signature mismatch')
+
+
+
+class EnhancedCallbackSecurityTest(TestCase):
+    """Test cases for the combined callback security layers"""
+    
+    def setUp(self):
+        from django.test import RequestFactory
+        self.factory = RequestFactory()
+        self.security = EnhancedCallbackSecurity(enable_hmac=False)
+    
+    def test_security_context_built_once_per_request(self):
+        """Test the context is stored on the request and credentials are dropped"""
+        request = self.factory.post(
+            '/payments/callback/', b'{}', content_type='application/json',
+            REMOTE_ADDR='196.201.214.200',
+            HTTP_AUTHORIZATION='Bearer secret',
+            HTTP_PROXY_AUTHORIZATION='Basic secret',
+            HTTP_COOKIE='sessionid=secret',
+            HTTP_X_AUTHORIZATION_HINT='kept',
+        )
+        context = self.security.get_security_context(request)
+        self.assertEqual(context['client_ip'], '196.201.214.200')
+        self.assertIsInstance(context['timestamp'], float)
+        self.assertNotIn('HTTP_AUTHORIZATION', context['headers'])
+        self.assertNotIn('HTTP_PROXY_AUTHORIZATION', context['headers'])
+        self.assertNotIn('HTTP_COOKIE', context['headers'])
+        self.assertEqual(context['headers']['HTTP_X_AUTHORIZATION_HINT'], 'kept')
+        
+        # Later calls return the stored context without rescanning META
+        request.META = {}
+        self.assertIs(self.security.get_security_context(request), context)
+
+    def test_validate_callback_parses_body_once(self):
+        """Test the signed body is checked and parsed once, and the payload returned"""
+        payload = {
+            'Body': {
+                'stkCallback': {
+                    'MerchantRequestID': '29115-34620561-1',
+                    'CheckoutRequestID': 'ws_CO_191220191020363925',
+                    'ResultCode': 0,
+                    'ResultDesc': 'The service request is processed successfully.',
+                }
+            }
+        }
+        body = json.dumps(payload).encode()
+        security = EnhancedCallbackSecurity()
+        security.hmac_validator = HMACSignatureValidator(secret_key='test-secret')
+        # A DRF Request, as the callback view passes, so request.data is available;
+        # Safaricom sends no X-Timestamp header
+        request = Request(self.factory.post(
+            '/payments/callback/', body, content_type='application/json',
+            REMOTE_ADDR='196.201.214.200',
+            HTTP_X_MPESA_SIGNATURE=security.hmac_validator.generate_signature(body),
+        ), parsers=[JSONParser()])
+
+        with patch('mpesa.callback_security.json_loads', wraps=json.loads) as mock_loads, \
+                patch.object(JSONParser, 'parse', return_value={}) as mock_parse:
+            result = security.validate_callback(request)
+
+        self.assertEqual(result['overall_status'], 'approved')
+        self.assertEqual(result['callback_data'], payload)
+        mock_loads.assert_called_once()
+        mock_parse.assert_not_called()
+
+    def test_validate_callback_rejects_spoofed_forwarded_ip(self):
+        """Test a Safaricom IP forwarded by a peer that isn't a trusted proxy is rejected"""
+        body = json.dumps({'Body': {'stkCallback': {
+            'MerchantRequestID': '29115-34620561-1',
+            'CheckoutRequestID': 'ws_CO_191220191020363925',
+            'ResultCode': 0,
+            'ResultDesc': 'Success',
+        }}}).encode()
+        request = self.factory.post(
+            '/payments/callback/', body, content_type='application/json',
+            REMOTE_ADDR='203.0.113.9',
+            HTTP_X_FORWARDED_FOR='196.201.214.200',
+            HTTP_X_REAL_IP='196.201.214.200',
+        )
+        result = self.security.validate_callback(request)
+        self.assertEqual(result['overall_status'], 'rejected')
+        self.assertEqual(result['rejection_reason'], 'IP not whitelisted')
+        
+        # Relayed by a trusted proxy, the forwarded address is used
+        request = self.factory.post(
+            '/payments/callback/', body, content_type='application/json',
+            REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='196.201.214.200',
+        )
+        self.assertEqual(self.security.validate_callback(request)['overall_status'], 'approved')
+
+    def test_validate_callback_rejects_invalid_json(self):
+        """Test a malformed body is rejected whichever JSON parser is in use"""
+        request = self.factory.post(
+            '/payments/callback/', b'{"Body": ', content_type='application/json',
+            REMOTE_ADDR='196.201.214.200',
+        )
+        result = self.security.validate_callback(request)
+        self.assertEqual(result['overall_status'], 'rejected')
+        self.assertEqual(result['rejection_reason'], 'Invalid JSON payload')
+
+    def test_validate_callback_content_type_case_insensitive(self):
+        """Test the JSON media type is matched regardless of case"""
+        request = self.factory.post(
+            '/payments/callback/', b'{"Body": {}}', content_type='Application/JSON; charset=UTF-8',
+            REMOTE_ADDR='196.201.214.200',
+        )
+        result = self.security.validate_callback(request)
+        self.assertNotEqual(result.get('rejection_reason'), 'Invalid method or content type')
+        self.assertIn('structure', result['validations'])
+
+    def test_validate_callback_rejects_probes_early(self):
+        """Test non-JSON, non-POST and empty requests are rejected before the body checks"""
+        self.security.structure_validator = Mock()
+        empty = self.factory.post('/payments/callback/', b'', content_type='application/json',
+                                  REMOTE_ADDR='196.201.214.200')
+        empty.META['CONTENT_TYPE'] = 'application/json'  # The factory drops it for empty bodies
+        requests = [
+            (self.factory.post('/payments/callback/', {'Body': 'x'}, REMOTE_ADDR='196.201.214.200'),
+             'Invalid method or content type'),
+            (self.factory.get('/payments/callback/', REMOTE_ADDR='196.201.214.200'),
+             'Invalid method or content type'),
+            (empty, 'Empty request body'),
+        ]
+        for request, reason in requests:
+            result = self.security.validate_callback(request)
+            self.assertEqual(result['overall_status'], 'rejected')
+            self.assertEqual(result['rejection_reason'], reason)
+        self.security.structure_validator.validate_structure.assert_not_called()
+
 class MpesaGateWayTest(TestCase):
     """Test cases for MpesaGateWay class"""
     
+    def setUp(self):
+        # Start every test without a token cached by an earlier gateway
+        token_patcher = patch('mpesa.stk_push._cached_token', (None, None, 0.0))
+        token_patcher.start()
+        self.addCleanup(token_patcher.stop)
+    
     @patch('mpesa.stk_push.env')
-    @patch('mpesa.stk_push.requests.get')
+    @patch('mpesa.stk_push.requests.Session.get')
     def test_gateway_initialization(self, mock_get, mock_env):
         """Test MpesaGateWay initialization"""
         # Mock environment variables
@@ -265,6 +781,77 @@ class MpesaGateWayTest(TestCase):
         self.assertIn('Authorization', gateway.headers)
         self.assertEqual(gateway.access_token, 'test_token')
     
+    @patch('mpesa.stk_push.env')
+    @patch('mpesa.stk_push.requests.Session.get')
+    def test_gateway_uses_pooled_session(self, mock_get, mock_env):
+        """Test that API calls go through a retrying, pooled session"""
+        mock_env.return_value = ''
+        mock_get.return_value.json.return_value = {'access_token': 'test_token'}
+        
+        gateway = MpesaGateWay()
+        
+        adapter = gateway.session.get_adapter('https://api.safaricom.co.ke')
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(504, adapter.max_retries.status_forcelist)
+        
+        # Every gateway in the process shares the same connection pool
+        self.assertIs(MpesaGateWay().session, gateway.session)
+    
+    @patch('mpesa.stk_push.env')
+    @patch('mpesa.stk_push.requests.Session.post')
+    @patch('mpesa.stk_push.requests.Session.get')
+    def test_access_token_shared_between_gateways(self, mock_get, mock_post, mock_env):
+        """Test that new gateways reuse a fresh token and refresh an expired one"""
+        mock_env.return_value = 'test'
+        mock_get.return_value.json.return_value = {'access_token': 'test_token'}
+        
+        first = MpesaGateWay()
+        second = MpesaGateWay()
+        
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(second.access_token, 'test_token')
+        self.assertEqual(second.headers, {'Authorization': 'Bearer test_token'})
+        
+        # Once expired, one refresh also pushes the expiry forward
+        mock_get.return_value.json.return_value = {'access_token': 'new_token'}
+        with patch('mpesa.stk_push.time.time', return_value=first.access_token_expiration + 1):
+            first.stk_push_query('ws_CO_test123')
+            first.stk_push_query('ws_CO_test123')
+        
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(first.access_token, 'new_token')
+    
+    @patch('mpesa.stk_push.env')
+    @patch('mpesa.stk_push.requests.Session.post')
+    @patch('mpesa.stk_push.requests.Session.get')
+    def test_concurrent_refresh_fetches_one_token(self, mock_get, mock_post, mock_env):
+        """Test that gateways refreshing at the same time share one OAuth call"""
+        mock_env.return_value = 'test'
+        mock_get.return_value.json.return_value = {'access_token': 'test_token'}
+        gateways = [MpesaGateWay() for _ in range(4)]
+        for gateway in gateways:
+            gateway.access_token_expiration = 1  # Long expired
+        
+        def slow_token(*args, **kwargs):
+            time.sleep(0.05)  # Keep the refresh in flight while the others arrive
+            return mock_get.return_value
+        mock_get.reset_mock()
+        mock_get.side_effect = slow_token
+        
+        # Expire the shared token too, so every thread needs a refresh
+        with patch('mpesa.stk_push._cached_token', (None, None, 0.0)):
+            threads = [
+                threading.Thread(target=gateway.stk_push_query, args=('ws_CO_test123',))
+                for gateway in gateways
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertTrue(all(g.access_token == 'test_token' for g in gateways))
+    
     @patch('mpesa.stk_push.env')
     def test_password_generation(self, mock_env):
         """Test password generation"""
@@ -273,7 +860,7 @@ class MpesaGateWayTest(TestCase):
             'pass_key': 'bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919'
         }.get(key, '')
         
-        with patch('mpesa.stk_push.requests.get') as mock_get:
+        with patch('mpesa.stk_push.requests.Session.get') as mock_get:
             mock_response = Mock()
             mock_response.json.return_value = {'access_token': 'test_token'}
             mock_response.raise_for_status.return_value = None
@@ -286,7 +873,7 @@ class MpesaGateWayTest(TestCase):
             self.assertIsInstance(password, str)
     
     @patch('mpesa.stk_push.env')
-    @patch('mpesa.stk_push.requests.post')
+    @patch('mpesa.stk_push.requests.Session.post')
     def test_stk_push_query(self, mock_post, mock_env):
         """Test STK push query functionality"""
         # Setup mocks
@@ -301,19 +888,19 @@ class MpesaGateWayTest(TestCase):
             'checkout_url': 'https://test.com/checkout'
         }.get(key, '')
         
-        with patch('mpesa.stk_push.requests.get') as mock_get:
+        with patch('mpesa.stk_push.requests.Session.get') as mock_get:
             mock_get_response = Mock()
             mock_get_response.json.return_value = {'access_token': 'test_token'}
             mock_get_response.raise_for_status.return_value = None
             mock_get.return_value = mock_get_response
             
             mock_post_response = Mock()
-            mock_post_response.json.return_value = {
+            mock_post_response.content = json.dumps({
                 'ResponseCode': '0',
                 'ResponseDescription': 'Success',
                 'ResultCode': '0',
                 'ResultDesc': 'Transaction successful'
-            }
+            }).encode()
             mock_post.return_value = mock_post_response
             
             gateway = MpesaGateWay()
@@ -323,6 +910,141 @@ class MpesaGateWayTest(TestCase):
             self.assertEqual(result['ResultCode'], '0')
 
 
+    @patch('mpesa.stk_push.env')
+    @patch('mpesa.stk_push.requests.Session.post')
+    @patch('mpesa.stk_push.requests.Session.get')
+    def test_async_stk_push_request(self, mock_get, mock_post, mock_env):
+        """Test that the async STK push sends the request and records the transaction"""
+        mock_env.return_value = 'test'
+        mock_get.return_value.json.return_value = {'access_token': 'test_token'}
+        mock_post.return_value.ok = True
+        mock_post.return_value.content = json.dumps({
+            'ResponseCode': '0',
+            'CheckoutRequestID': 'ws_CO_async123',
+        }).encode()
+        
+        payload = {
+            'request': RequestFactory().post('/payments/checkout/', REMOTE_ADDR='127.0.0.1'),
+            'data': {'phone_number': '254718643064', 'amount': Decimal('100.00')},
+        }
+        result = async_to_sync(MpesaGateWay().astk_push_request)(payload)
+        
+        self.assertEqual(result['CheckoutRequestID'], 'ws_CO_async123')
+        req_data = json.loads(mock_post.call_args.kwargs['data'])
+        self.assertEqual(mock_post.call_args.kwargs['headers']['Content-Type'], 'application/json')
+        self.assertEqual(req_data['TransactionType'], 'CustomerPayBillOnline')
+        self.assertEqual(req_data['PartyA'], '254718643064')
+        self.assertEqual(req_data['Amount'], 100)
+        self.assertEqual(len(req_data), 11)
+        transaction = Transaction.objects.get(checkout_request_id='ws_CO_async123')
+        self.assertEqual(transaction.status, '1')
+        self.assertEqual(transaction.ip, '127.0.0.1')
+
+    @patch('mpesa.stk_push.env')
+    @patch('mpesa.stk_push.requests.Session.get')
+    def test_handle_successful_pay(self, mock_get, mock_env):
+        """Test callback metadata items are applied to the transaction"""
+        mock_env.return_value = 'test'
+        mock_get.return_value.json.return_value = {'access_token': 'test_token'}
+        transaction = Transaction.objects.create(
+            phone_number='254718643064',
+            amount='100',
+            checkout_request_id='ws_CO_test123',
+            status='1',
+        )
+        data = {
+            'Body': {
+                'stkCallback': {
+                    'CheckoutRequestID': 'ws_CO_test123',
+                    'ResultCode': 0,
+                    'CallbackMetadata': {
+                        'Item': [
+                            {'Name': 'Amount', 'Value': 150},
+                            {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+                            {'Name': 'Balance'},
+                            {'Name': 'TransactionDate', 'Value': 20191219102115},
+                            {'Name': 'PhoneNumber', 'Value': 254722000000},
+                        ]
+                    }
+                }
+            }
+        }
+        
+        MpesaGateWay().handle_successful_pay(data, transaction)
+        
+        self.assertEqual(transaction.status, '0')
+        self.assertEqual(transaction.amount, '150')
+        self.assertEqual(transaction.receipt_no, 'NLJ7RT61SV')
+        self.assertEqual(str(transaction.phone_number), '254722000000')
+
+    @patch('mpesa.stk_push.env')
+    @patch('mpesa.stk_push.requests.Session.get')
+    def test_callback_handler_updates_in_one_query(self, mock_get, mock_env):
+        """Test a callback for a known transaction is applied with a single UPDATE"""
+        mock_env.return_value = 'test'
+        mock_get.return_value.json.return_value = {'access_token': 'test_token'}
+        transaction = Transaction.objects.create(
+            phone_number='254718643064',
+            amount='100',
+            checkout_request_id='ws_CO_test123',
+            status='1',
+        )
+        gateway = MpesaGateWay()
+        data = {
+            'Body': {
+                'stkCallback': {
+                    'CheckoutRequestID': 'ws_CO_test123',
+                    'ResultCode': 0,
+                    'CallbackMetadata': {
+                        'Item': [
+                            {'Name': 'Amount', 'Value': 100},
+                            {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+                        ]
+                    }
+                }
+            }
+        }
+        
+        with self.assertNumQueries(1):
+            response = gateway.callback_handler(data)
+        
+        self.assertEqual(response.status_code, 200)
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.status, '0')
+        self.assertEqual(transaction.receipt_no, 'NLJ7RT61SV')
+        self.assertGreater(transaction.updated_at, transaction.created)
+        
+        # Failure codes map to their statuses; unknown IDs get a new row
+        data['Body']['stkCallback'].update(CheckoutRequestID='ws_CO_unknown', ResultCode=1032)
+        del data['Body']['stkCallback']['CallbackMetadata']
+        with patch.object(Transaction.objects, 'get_or_create') as get_or_create:
+            gateway.callback_handler(data)
+        get_or_create.assert_called_once()
+        self.assertEqual(get_or_create.call_args.kwargs['defaults']['status'], '3')
+
+    @override_settings(MPESA_ASYNC_CALLBACKS=True)
+    @patch('mpesa.stk_push._callback_executor')
+    @patch('mpesa.stk_push.env')
+    @patch('mpesa.stk_push.requests.Session.get')
+    def test_callback_handler_applies_in_background(self, mock_get, mock_env, mock_executor):
+        """Test callbacks are acknowledged at once and applied on the executor"""
+        mock_env.return_value = 'test'
+        mock_get.return_value.json.return_value = {'access_token': 'test_token'}
+        gateway = MpesaGateWay()
+        data = {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_test123', 'ResultCode': 1032}}}
+        
+        with self.assertNumQueries(0):
+            response = gateway.callback_handler(data)
+        
+        self.assertEqual(response.status_code, 200)
+        mock_executor.submit.assert_called_once_with(_apply_callback_in_background, gateway, data)
+        
+        # Malformed callbacks still fail in the request
+        with self.assertRaisesMessage(ValueError, 'no Body.stkCallback.CheckoutRequestID'):
+            gateway.callback_handler({'Body': {'stkCallback': {}}})
+        mock_executor.submit.assert_called_once()
+
+
 class MpesaAPIViewsTest(APITestCase):
     """Test cases for M-Pesa API views"""
     
@@ -394,6 +1116,8 @@ class MpesaAPIViewsTest(APITestCase):
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(response.data['ResponseCode'], '0')
             self.assertIn('local_transaction', response.data)
+            self.assertEqual(response.data['local_transaction']['status'], '0')
+            self.assertEqual(response.data['local_transaction']['status_display'], 'Complete')
             mock_gateway.stk_push_query.assert_called_once_with('ws_CO_test123')
     
     def test_query_view_missing_checkout_id(self):
@@ -419,6 +1143,27 @@ class MpesaAPIViewsTest(APITestCase):
         response = self.client.post(self.callback_url, callback_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
     
+    def test_callback_view_rejects_spoofed_forwarded_ip(self):
+        """Test a Safaricom IP in forwarding headers from an untrusted peer is ignored"""
+        callback_data = {
+            "Body": {
+                "stkCallback": {
+                    "CheckoutRequestID": "ws_CO_test123",
+                    "ResultCode": 0,
+                    "ResultDesc": "Success"
+                }
+            }
+        }
+        
+        response = self.client.post(
+            self.callback_url, callback_data, format='json',
+            REMOTE_ADDR='203.0.113.9',
+            HTTP_X_FORWARDED_FOR='196.201.214.200',
+            HTTP_X_REAL_IP='196.201.214.200',
+            HTTP_CF_CONNECTING_IP='196.201.214.200',
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
     @patch('mpesa.views.SafaricomIPWhitelist.has_permission')
     def test_callback_view_successful_payment(self, mock_permission):
         """Test callback view with successful payment"""
@@ -461,8 +1206,8 @@ class MpesaIntegrationTest(TestCase):
     def setUp(self):
         self.client = Client()
     
-    @patch('mpesa.stk_push.requests.get')
-    @patch('mpesa.stk_push.requests.post')
+    @patch('mpesa.stk_push.requests.Session.get')
+    @patch('mpesa.stk_push.requests.Session.post')
     @patch('mpesa.stk_push.env')
     def test_complete_payment_flow(self, mock_env, mock_post, mock_get):
         """Test complete payment flow from initiation to callback"""
@@ -486,12 +1231,12 @@ class MpesaIntegrationTest(TestCase):
         
         # Mock STK push response
         mock_post_response = Mock()
-        mock_post_response.json.return_value = {
+        mock_post_response.content = json.dumps({
             'ResponseCode': '0',
             'ResponseDescription': 'Success',
             'CheckoutRequestID': 'ws_CO_test123',
             'MerchantRequestID': 'test_merchant_123'
-        }
+        }).encode()
         mock_post_response.ok = True
         mock_post.return_value = mock_post_response
         
@@ -549,6 +1294,11 @@ class MpesaIntegrationTest(TestCase):
         self.assertEqual(transaction.receipt_no, 'NLJ7RT61SV')
 
 
+# The manifest storage used when DEBUG is off needs collectstatic output
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
 class MpesaModelAdminTest(TestCase):
     """Test cases for Django admin integration"""
     
@@ -577,6 +1327,25 @@ class MpesaModelAdminTest(TestCase):
         self.assertContains(response, self.transaction.transaction_no)
         self.assertContains(response, '+254718643064')
     
+    def test_admin_list_cache_invalidated_on_save(self):
+        """Test that the cached admin list is dropped when a transaction is written"""
+        cache.clear()
+        # The first response sets the CSRF cookie, which changes the cache key
+        self.client.get('/admin/mpesa/transaction/')
+        self.client.get('/admin/mpesa/transaction/')
+        
+        # Further requests inside the window are served from the cache
+        with self.assertNumQueries(2):  # Session and user lookups only
+            self.client.get('/admin/mpesa/transaction/')
+        
+        new_transaction = Transaction.objects.create(
+            phone_number='+254718643065',
+            amount='50',
+            checkout_request_id='ws_CO_test456',
+        )
+        response = self.client.get('/admin/mpesa/transaction/')
+        self.assertContains(response, new_transaction.transaction_no)
+    
     def test_admin_transaction_detail_view(self):
         """Test admin detail view for transaction"""
         response = self.client.get(f'/admin/mpesa/transaction/{self.transaction.id}/change/')
@@ -591,6 +1360,205 @@ class MpesaModelAdminTest(TestCase):
         self.assertContains(response, 'readonly')
 
 
+
+class FixMissingReceiptsCommandTest(TestCase):
+    """Test cases for the fix_missing_receipts management command"""
+    
+    def setUp(self):
+        self.transaction = Transaction.objects.create(
+            phone_number='+254718643064',
+            amount='100',
+            reference='TEST-001',
+            checkout_request_id='ws_CO_test123',
+            status='0',
+            ip='127.0.0.1'
+        )
+    
+    def test_no_missing_receipts(self):
+        """Test the command stops after a single query when nothing needs fixing"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        self.transaction.receipt_no = 'NLJ7RT61SV'
+        self.transaction.save()
+        out = StringIO()
+        with self.assertNumQueries(1):
+            call_command('fix_missing_receipts', stdout=out)
+        self.assertIn('No completed transactions missing receipt numbers found', out.getvalue())
+    
+    @patch('mpesa.utils.time.sleep')
+    @patch('mpesa.management.commands.fix_missing_receipts.MpesaGateWay')
+    def test_dry_run_reports_without_saving(self, mock_gateway, mock_sleep):
+        """Test a dry run counts found receipts but leaves the row untouched"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        mock_gateway.return_value.stk_push_query.return_value = {
+            'ResultCode': '0',
+            'local_transaction': {'receipt_no': 'NLJ7RT61SV'},
+        }
+        out = StringIO()
+        call_command('fix_missing_receipts', '--dry-run', stdout=out)
+        
+        self.assertIn('Found 1 transactions missing receipt numbers', out.getvalue())
+        self.assertIn('Transactions processed: 1', out.getvalue())
+        self.transaction.refresh_from_db()
+        self.assertIsNone(self.transaction.receipt_no)
+
+    @patch('mpesa.utils.time.sleep')
+    @patch('mpesa.management.commands.fix_missing_receipts.MpesaGateWay')
+    def test_receipts_saved_in_one_update(self, mock_gateway, mock_sleep):
+        """Test found receipts are written with a single batched UPDATE"""
+        from io import StringIO
+        from django.core.management import call_command
+
+        second = Transaction.objects.create(
+            phone_number='+254718643064',
+            amount='50',
+            reference='TEST-002',
+            checkout_request_id='ws_CO_test124',
+            status='0',
+            ip='127.0.0.1'
+        )
+        receipts = {'ws_CO_test123': 'NLJ7RT61SV', 'ws_CO_test124': 'NLJ7RT61SW'}
+        mock_gateway.return_value.stk_push_query.side_effect = lambda checkout_id: {
+            'ResultCode': '0',
+            'local_transaction': {'receipt_no': receipts[checkout_id]},
+        }
+
+        # One SELECT for the candidates, one UPDATE for both rows
+        with self.assertNumQueries(2):
+            call_command('fix_missing_receipts', stdout=StringIO())
+
+        self.transaction.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(self.transaction.receipt_no, 'NLJ7RT61SV')
+        self.assertEqual(second.receipt_no, 'NLJ7RT61SW')
+
+
+class ClientIPTest(TestCase):
+    """Test cases for utils.get_client_ip"""
+    
+    def test_forwarding_headers_need_trusted_proxy(self):
+        """Test forwarding headers are only read when a trusted proxy connected"""
+        from .utils import get_client_ip, is_trusted_proxy
+        factory = RequestFactory()
+        self.assertTrue(is_trusted_proxy('127.0.0.1'))
+        self.assertFalse(is_trusted_proxy('203.0.113.9'))
+        self.assertFalse(is_trusted_proxy('not-an-ip'))
+        
+        request = factory.get('/', HTTP_X_FORWARDED_FOR='196.201.214.200', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(get_client_ip(request), '196.201.214.200')
+        
+        request = factory.get('/', HTTP_X_FORWARDED_FOR='196.201.214.200', REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(get_client_ip(request), '203.0.113.9')
+
+
+class TokenBucketTest(TestCase):
+    """Test cases for the token-bucket rate limiter"""
+    
+    @patch('mpesa.utils.time')
+    def test_burst_then_wait(self, mock_time):
+        """Test a full bucket allows a burst, then sleeps only for the shortfall"""
+        from .utils import TokenBucket
+        
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(capacity=2, refill_per_sec=2.0)
+        bucket.acquire()
+        bucket.acquire()
+        mock_time.sleep.assert_not_called()
+        
+        # Empty bucket: one token takes 0.5s at 2 tokens/second
+        mock_time.sleep.side_effect = lambda seconds: setattr(
+            mock_time.monotonic, 'return_value', mock_time.monotonic.return_value + seconds
+        )
+        bucket.acquire()
+        mock_time.sleep.assert_called_once_with(0.5)
+        
+        # Idle time is credited, so no wait after a pause
+        mock_time.monotonic.return_value += 10
+        mock_time.sleep.reset_mock()
+        bucket.acquire()
+        mock_time.sleep.assert_not_called()
+
+
+class QueuedLoggingTest(TestCase):
+    """Test cases for the queued file log handlers"""
+    
+    def test_file_handlers_enqueue_records(self):
+        """Test that security records go to the queue drained by a listener"""
+        import logging
+        from logging.handlers import QueueHandler
+        from django.conf import settings
+        from .apps import start_log_listeners
+        
+        handlers = logging.getLogger('mpesa.security').handlers
+        self.assertTrue(handlers)
+        self.assertTrue(all(isinstance(handler, QueueHandler) for handler in handlers))
+        self.assertIs(handlers[0].queue, settings.SECURITY_LOG_QUEUE)
+        
+        # Listeners are started once per process
+        listeners = start_log_listeners()
+        self.assertEqual(len(listeners), len(settings.LOG_QUEUE_LISTENERS))
+        self.assertIs(start_log_listeners(), listeners)
+    
+    def test_forked_process_starts_own_listeners(self):
+        """Test a process that inherited the listeners starts its own and drops overflow"""
+        import logging
+        import os
+        from queue import Queue
+        from . import apps
+        
+        handler = apps.ProcessQueueHandler(Queue(1))
+        record = logging.makeLogRecord({'msg': 'record'})
+        # Listeners recorded for another pid, as in a worker forked from the master
+        with patch.object(apps, '_log_listeners_pid', -1), \
+                patch.object(apps, '_log_listeners', []), \
+                patch.object(apps, '_start_listeners', return_value=['listener']) as start:
+            handler.enqueue(record)
+            handler.enqueue(record)  # Queue full: dropped, not raised
+            start.assert_called_once()
+            self.assertEqual(apps._log_listeners_pid, os.getpid())
+        self.assertEqual(handler.queue.qsize(), 1)
+    
+    def test_rotated_logs_are_gzipped(self):
+        """Test that a rollover writes a gzipped backup"""
+        import gzip
+        import logging
+        import tempfile
+        from pathlib import Path
+        from logging.handlers import RotatingFileHandler
+        from .apps import gzip_namer, gzip_rotator
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            log_file = Path(tmp) / 'django.log'
+            handler = RotatingFileHandler(log_file, maxBytes=10, backupCount=2, encoding='utf-8')
+            handler.namer = gzip_namer
+            handler.rotator = gzip_rotator
+            handler.emit(logging.makeLogRecord({'msg': 'first record'}))
+            handler.emit(logging.makeLogRecord({'msg': 'second record'}))
+            handler.close()
+            
+            with gzip.open(Path(tmp) / 'django.log.1.gz', 'rt') as backup:
+                self.assertIn('first record', backup.read())
+            self.assertIn('second record', log_file.read_text())
+
+
+
+class WarmUpTest(TestCase):
+    """Test cases for the startup warm-up"""
+    
+    def test_warm_up_populates_resolver(self):
+        """Test that warm_up builds the URL lookup tables without touching the gateway"""
+        from django.urls import get_resolver
+        from .views import warm_up
+        
+        with patch('mpesa.views.MpesaGateWay') as mock_gateway:
+            warm_up()
+            mock_gateway.assert_not_called()
+        self.assertTrue(get_resolver()._populated)
+
+
 if __name__ == '__main__':
     import django
     from django.test.utils import get_runner
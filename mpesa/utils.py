@@ -5,11 +5,109 @@ This module contains helper functions that are used across different
 parts of the M-Pesa integration system.
 """
 
+import ipaddress
+import json
 import logging
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    # orjson parses and serializes payloads several times faster than the stdlib
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        """Serialize obj to compact UTF-8 JSON bytes, like orjson.dumps."""
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+# Both loaders raise json.JSONDecodeError (orjson's error subclasses it) on bad input
 
 # Initialize logger for this module
 logger = logging.getLogger("default")
 
+# Trusted proxy networks (settings.ALLOWED_PROXY_IPS), parsed once at import
+TRUSTED_PROXY_NETWORKS = tuple(
+    ipaddress.ip_network(cidr, strict=False)
+    for cidr in getattr(settings, 'ALLOWED_PROXY_IPS', ())
+)
+
+
+def is_trusted_proxy(addr):
+    """
+    Check whether an address belongs to one of the trusted proxy networks.
+    
+    Args:
+        addr (str): IP address to check (e.g. REMOTE_ADDR)
+        
+    Returns:
+        bool: True if the address is inside ALLOWED_PROXY_IPS, False otherwise
+    """
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXY_NETWORKS)
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter.
+    
+    The bucket holds up to `capacity` tokens and refills continuously at
+    `refill_per_sec`. Each call takes one token, so bursts of up to
+    `capacity` go through immediately while the long-run rate stays at
+    `refill_per_sec`; time spent elsewhere between calls counts as credit.
+    
+    Example:
+        >>> bucket = TokenBucket(capacity=5, refill_per_sec=2.0)
+        >>> bucket.acquire()  # Returns at once while tokens are left
+    """
+    
+    def __init__(self, capacity, refill_per_sec):
+        """
+        Args:
+            capacity (int): Maximum number of tokens (burst size)
+            refill_per_sec (float): Tokens added per second
+        """
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self):
+        """Add the tokens earned since the last refill, up to capacity."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_sec)
+        self.last_refill = now
+    
+    def try_acquire(self):
+        """
+        Take one token if one is available, without waiting.
+        
+        Returns:
+            bool: True if a token was taken, False if the bucket is empty
+        """
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+    
+    def acquire(self):
+        """Take one token, sleeping only as long as needed for one to be available."""
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                time.sleep((1 - self.tokens) / self.refill_per_sec)
+                self._refill()
+            self.tokens -= 1
+
 
 def get_client_ip(request):
     """
@@ -17,6 +115,8 @@ def get_client_ip(request):
     
     This function checks various HTTP headers to find the actual client IP address
     when the application is running behind proxies, load balancers, or CDNs.
+    The headers are only read when the connecting peer is a trusted proxy
+    (settings.ALLOWED_PROXY_IPS); anyone else could set them to any value.
     
     Args:
         request (HttpRequest): Django HTTP request object
@@ -29,6 +129,12 @@ def get_client_ip(request):
         >>> ip = get_client_ip(request)
         >>> print(ip)  # e.g., "192.168.1.100"
     """
+    # Forwarding headers only mean something when a trusted proxy set them
+    remote_addr = request.META.get('REMOTE_ADDR', 'Unknown')
+    if not is_trusted_proxy(remote_addr):
+        logger.debug("Untrusted peer %s, ignoring forwarding headers", remote_addr)
+        return remote_addr
+    
     # Dictionary to store found IPs for logging
     found_ips = {}
     
@@ -39,14 +145,14 @@ def get_client_ip(request):
         # Format: "client_ip, proxy1_ip, proxy2_ip"
         ip_list = [ip.strip() for ip in x_forwarded_for.split(',')]
         client_ip = ip_list[0]  # First IP is the original client
-        found_ips['X-Forwarded-For'] = f"{client_ip} (from: {x_forwarded_for})"
+        found_ips['X-Forwarded-For'] = x_forwarded_for
         
         # Validate that it's not a local/private IP if we have multiple IPs
         if len(ip_list) > 1 and not _is_private_ip(client_ip):
-            logger.info("Client IP from X-Forwarded-For: {}".format(client_ip))
+            logger.debug("Client IP from X-Forwarded-For: %s", client_ip)
             return client_ip
         elif len(ip_list) == 1:
-            logger.info("Client IP from X-Forwarded-For: {}".format(client_ip))
+            logger.debug("Client IP from X-Forwarded-For: %s", client_ip)
             return client_ip
     
     # Check for X-Real-IP header (common with nginx)
@@ -55,7 +161,7 @@ def get_client_ip(request):
         ip = x_real_ip.strip()
         found_ips['X-Real-IP'] = ip
         if not _is_private_ip(ip):
-            logger.info("Client IP from X-Real-IP: {}".format(ip))
+            logger.debug("Client IP from X-Real-IP: %s", ip)
             return ip
     
     # Check for Cloudflare's connecting IP
@@ -63,7 +169,7 @@ def get_client_ip(request):
     if cf_connecting_ip:
         ip = cf_connecting_ip.strip()
         found_ips['CF-Connecting-IP'] = ip
-        logger.info("Client IP from CF-Connecting-IP: {}".format(ip))
+        logger.debug("Client IP from CF-Connecting-IP: %s", ip)
         return ip
     
     # Check for other common headers
@@ -81,20 +187,19 @@ def get_client_ip(request):
             ip = value.split(',')[0].strip()
             found_ips[header] = ip
             if not _is_private_ip(ip):
-                logger.info("Client IP from {}: {}".format(header, ip))
+                logger.debug("Client IP from %s: %s", header, ip)
                 return ip
     
     # Fall back to REMOTE_ADDR
-    remote_addr = request.META.get('REMOTE_ADDR', 'Unknown')
     found_ips['REMOTE_ADDR'] = remote_addr
     
     # Log all found IPs for debugging
     if found_ips:
-        logger.info("IP detection results: {}".format(found_ips))
+        logger.debug("IP detection results: %s", found_ips)
     else:
         logger.warning("No IP address found in request headers")
     
-    logger.info("Using REMOTE_ADDR as client IP: {}".format(remote_addr))
+    logger.debug("Using REMOTE_ADDR as client IP: %s", remote_addr)
     return remote_addr
 
 
@@ -139,4 +244,4 @@ def log_request_headers(request, prefix="Request"):
         if key.startswith('HTTP_') or key in ['REMOTE_ADDR', 'REMOTE_HOST', 'SERVER_NAME']
     }
     
-    logger.info("{} headers: {}".format(prefix, relevant_headers))
+    logger.info("%s headers: %s", prefix, relevant_headers)
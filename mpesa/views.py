@@ -34,7 +34,10 @@ import json
 import logging
 import hashlib
 
+from django.core.exceptions import ValidationError
 from django.shortcuts import render
+from django.urls import get_resolver
+from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework.decorators import authentication_classes, permission_classes
@@ -42,8 +45,11 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from .models import Transaction
+from .phone_number_validation import KENYA_REGION, validate_possible_number
 from .serializers import MpesaCheckoutSerializer, TransactionSerializer
 from .stk_push import MpesaGateWay
+from .utils import json_loads
 from .callback_security import SafaricomIPWhitelist, EnhancedCallbackSecurity
 
 # Initialize secure loggers
@@ -69,6 +75,28 @@ def get_gateway():
     return get_gateway._gateway
 
 
+def warm_up():
+    """
+    Do one-off startup work at worker boot instead of on the first request.
+    
+    Called from MpesaConfig.ready(). Populates the URL resolver's lookup
+    tables and loads the phonenumbers metadata for Kenya, both of which are
+    otherwise built lazily by the first checkout or callback request.
+    
+    The gateway (and its OAuth token request) stays lazy, see get_gateway().
+    """
+    # Force URLconf import and build the reverse/lookup dictionaries
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+    
+    # Load Kenyan numbering metadata used by every phone validation
+    try:
+        validate_possible_number('+254712345678', KENYA_REGION)
+    except ValidationError:
+        logger.warning("Phone number validation warm-up failed")
+
+
 def payment_form(request):
     """
     Render the payment form template for frontend interface.
@@ -85,6 +113,7 @@ def payment_form(request):
     return render(request, 'payment_form.html')
 
 
+@never_cache
 def transaction_status(request, checkout_request_id):
     """
     Display transaction status page for a specific payment.
@@ -100,7 +129,6 @@ def transaction_status(request, checkout_request_id):
         HttpResponse: Rendered transaction status page or error page
     """
     try:
-        from .models import Transaction
         # Retrieve transaction by checkout request ID
         transaction = Transaction.objects.get(checkout_request_id=checkout_request_id)
         return render(request, 'transaction_status.html', {'transaction': transaction})
@@ -111,6 +139,7 @@ def transaction_status(request, checkout_request_id):
         })
 
 
+@never_cache
 def transaction_receipt_print(request, checkout_request_id):
     """
     Display print-friendly transaction receipt for a specific payment.
@@ -126,7 +155,6 @@ def transaction_receipt_print(request, checkout_request_id):
         HttpResponse: Rendered print-friendly receipt page or error page
     """
     try:
-        from .models import Transaction
         # Retrieve transaction by checkout request ID
         transaction = Transaction.objects.get(checkout_request_id=checkout_request_id)
         
@@ -238,7 +266,6 @@ class MpesaStkQuery(APIView):
         
         # Update local transaction status based on M-Pesa response
         try:
-            from .models import Transaction
             transaction = Transaction.objects.get(checkout_request_id=checkout_request_id)
             
                         # Map M-Pesa ResultCode to our local status codes
@@ -273,8 +300,7 @@ class MpesaStkQuery(APIView):
                 else:
                     print(f"Transaction {checkout_request_id} status unchanged: {transaction.status}")
             
-            # Get updated transaction data
-            transaction.refresh_from_db()
+            # The instance already holds what was just saved; no need to re-read it
             transaction_data = TransactionSerializer(transaction).data
             res['local_transaction'] = transaction_data
             
@@ -303,6 +329,7 @@ enhanced_security = EnhancedCallbackSecurity(
 @authentication_classes([])  # Disable authentication for callback
 @permission_classes((SafaricomIPWhitelist,))  # Only allow Safaricom IPs
 @method_decorator(csrf_exempt, name='dispatch')  # Disable CSRF for callback
+@method_decorator(never_cache, name='dispatch')  # Never serve callbacks from cache
 class MpesaCallBack(APIView):
     """
     API view for handling M-Pesa payment callbacks from Safaricom.
@@ -375,15 +402,15 @@ class MpesaCallBack(APIView):
             logger.info("Enhanced security validation passed - Processing M-Pesa callback")
             
             # Get validated callback data
-            if 'structure' in security_result.get('validations', {}):
-                structure_validation = security_result['validations']['structure']
-                if structure_validation.get('valid') and 'sanitized_data' in structure_validation:
-                    callback_data = structure_validation['sanitized_data']
-                else:
-                    # Fallback to raw data if structure validation not enabled
-                    callback_data = json.loads(request.body) if request.body else {}
+            structure_validation = security_result.get('validations', {}).get('structure', {})
+            if structure_validation.get('valid') and 'sanitized_data' in structure_validation:
+                callback_data = structure_validation['sanitized_data']
+            elif 'callback_data' in security_result:
+                # Already parsed during security validation
+                callback_data = security_result['callback_data']
             else:
-                callback_data = json.loads(request.body) if request.body else {}
+                # Fallback to raw data if structure validation not enabled
+                callback_data = json_loads(request.body) if request.body else {}
             
             # Process callback through gateway handler
             result = get_gateway().callback_handler(callback_data)
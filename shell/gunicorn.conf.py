@@ -10,6 +10,8 @@ backlog = 2048
 # Worker processes
 workers = multiprocessing.cpu_count() * 2 + 1  # Recommended: (2 x CPU cores) + 1
 worker_class = "sync"
+# To serve config.asgi:application on an event loop instead, install uvicorn and use
+# worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
 timeout = 30
 keepalive = 60
@@ -38,6 +40,8 @@ tmp_upload_dir = None
 # certfile = None
 
 # Environment
+# For a dedicated API worker pool (payments/ only, no admin/sessions/CSRF),
+# run a second instance with DJANGO_SETTINGS_MODULE=config.settings_api
 raw_env = [
     'DJANGO_SETTINGS_MODULE=config.settings',
     'CLOUDFLARE_TUNNEL=True',
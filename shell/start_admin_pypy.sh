@@ -0,0 +1,28 @@
+#!/bin/bash
+# Admin-site Gunicorn startup script on PyPy (admin.digilaboratory.org)
+#
+# The admin changelist is template and ORM heavy, which PyPy's JIT speeds up
+# once warm. The payments API keeps running on CPython (start_prod.sh).
+# The PyPy venv needs psycopg2cffi (or psycopg[binary]) instead of
+# psycopg2-binary when DATABASE_URL points at PostgreSQL.
+
+echo "🚀 Starting M-Pesa admin on PyPy with Gunicorn on port 5001"
+
+# Set environment variables
+export DEBUG=False
+export CLOUDFLARE_TUNNEL=True
+export DJANGO_SETTINGS_MODULE=config.settings
+
+# Ensure logs directory exists
+mkdir -p logs
+
+cd /home/devops/MPESA/mpesa
+
+# Start Gunicorn from the PyPy venv; fewer workers live longer so the JIT stays warm
+exec /home/devops/MPESA/mpesa/venv-pypy/bin/pypy3 -m gunicorn \
+    --config gunicorn.conf.py \
+    --bind 0.0.0.0:5001 \
+    --workers 2 \
+    --max-requests 0 \
+    --pid logs/gunicorn_admin.pid \
+    config.wsgi:application